@@ -0,0 +1,35 @@
+"""
+atomic.py
+---------
+原子寫檔：先寫到同一資料夾中的暫存檔（tempfile.mkstemp，名稱不會重複），
+寫完再以 os.replace 取代目標檔。
+
+    with atomic_write(path) as f:
+        json.dump(data, f)
+
+    - 中途被中斷或丟出例外時，目標檔維持原狀（不會留下寫一半的檔案），暫存檔會刪除
+    - 多個行程同時寫同一個檔案時各自使用不同的暫存檔，最後完成的那一份生效
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", encoding: Optional[str] = "utf-8") -> Iterator[IO]:
+    """開啟暫存檔供寫入，區塊正常結束後才取代 path；mode 為 "wb" 時不使用 encoding"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
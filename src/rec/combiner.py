@@ -1,11 +1,18 @@
 from __future__ import annotations
 import os
 import pandas as pd
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 from .config import OUTPUT_DIR
+from .sketch import DEFAULT_ALPHA, LogHistogram
 
 FILTER_CSV = "filter.csv"
 COUNT_CSV = "count.csv"
+QUANTILE_CSV = "quantile.csv"
+HISTOGRAM_CSV = "histogram.csv"
+
+# 需要分位數 / 直方圖的欄位與輸出的分位數
+SKETCH_FIELDS = ("總價元", "車位總價元")
+QUANTILES = {"中位數": 0.5, "p90": 0.9, "p99": 0.99}
 
 def combine_all(dfs: List[pd.DataFrame]) -> pd.DataFrame:
     """
@@ -60,7 +67,8 @@ def apply_filters(df: pd.DataFrame) -> pd.DataFrame:
     # 綜合條件
     final_condition = cond1 & cond2 & cond3
     
-    return df[final_condition].copy()
+    # 布林索引本身就會產生新的 DataFrame，不需要再 .copy()
+    return df[final_condition]
 
 def aggregate_counts(filtered: pd.DataFrame) -> pd.DataFrame:
     """
@@ -105,4 +113,61 @@ def export_results(filtered: pd.DataFrame, counts: pd.DataFrame, out_dir: str =
     print(f"  匯出 filter.csv: {filtered.shape[0]} 筆資料")
     print(f"  匯出 count.csv: 統計摘要")
     
-    return filter_path, count_path
\ No newline at end of file
+    return filter_path, count_path
+
+def update_sketches(filtered: pd.DataFrame,
+                    sketches: Optional[Dict[str, LogHistogram]] = None,
+                    alpha: float = DEFAULT_ALPHA) -> Dict[str, LogHistogram]:
+    """
+    以一塊（chunk）篩選後資料更新 SKETCH_FIELDS 的串流草圖。
+    可對每個檔案 / 每個 worker 分別呼叫，再用 merge_sketches 合併。
+    """
+    if sketches is None:
+        sketches = {field: LogHistogram(alpha=alpha) for field in SKETCH_FIELDS}
+    for field in SKETCH_FIELDS:
+        if field in filtered.columns:
+            sketches[field].update(filtered[field].to_numpy())
+    return sketches
+
+def merge_sketches(parts: Iterable[Dict[str, LogHistogram]]) -> Dict[str, LogHistogram]:
+    """
+    合併多份草圖（例如各檔案或各 worker 的結果）
+    """
+    merged: Dict[str, LogHistogram] = {}
+    for part in parts:
+        for field, sk in part.items():
+            if field in merged:
+                merged[field].merge(sk)
+            else:
+                merged[field] = LogHistogram.from_dict(sk.to_dict())
+    return merged
+
+def export_sketches(sketches: Dict[str, LogHistogram], out_dir: str = OUTPUT_DIR) -> Tuple[str, str]:
+    """
+    匯出分位數（quantile.csv）與直方圖（histogram.csv），與 count.csv 放在同一資料夾。
+    分位數相對誤差上限為各草圖的 alpha（一併寫入 quantile.csv）。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    quantile_path = os.path.join(out_dir, QUANTILE_CSV)
+    histogram_path = os.path.join(out_dir, HISTOGRAM_CSV)
+
+    quantile_rows = []
+    histogram_rows = []
+    for field, sk in sketches.items():
+        row = {"欄位": field, "件數": sk.count, "平均": sk.mean()}
+        for label, q in QUANTILES.items():
+            row[label] = sk.quantile(q)
+        row["相對誤差上限"] = sk.alpha
+        quantile_rows.append(row)
+
+        for lower, upper, n in sk.buckets():
+            histogram_rows.append({"欄位": field, "下界": lower, "上界": upper, "件數": n})
+
+    pd.DataFrame(quantile_rows).to_csv(quantile_path, index=False, encoding="utf-8-sig")
+    pd.DataFrame(histogram_rows, columns=["欄位", "下界", "上界", "件數"]).to_csv(
+        histogram_path, index=False, encoding="utf-8-sig")
+
+    print(f"  匯出 quantile.csv: {len(quantile_rows)} 個欄位")
+    print(f"  匯出 histogram.csv: {len(histogram_rows)} 個桶")
+
+    return quantile_path, histogram_path
@@ -9,6 +9,24 @@ load_dotenv()
 DATA_DIR: str = os.getenv("DATA_DIR", "data")
 # 處理後輸出的資料夾
 OUTPUT_DIR: str = os.getenv("OUTPUT_DIR", "output")
+# 記憶體超過預算時，暫存 DataFrame 的落地資料夾
+SPILL_DIR: str = os.getenv("SPILL_DIR", os.path.join(DATA_DIR, "_spill"))
+
+# 欄位格式登錄表（標題指紋 -> 解析計畫）
+SCHEMA_REGISTRY_PATH: str = os.getenv("SCHEMA_REGISTRY_PATH", os.path.join(DATA_DIR, "schema_registry.json"))
+
+# 分片執行時各 worker 共用的輸出資料夾（每個分片一個子資料夾）
+SHARD_DIR: str = os.getenv("SHARD_DIR", os.path.join(OUTPUT_DIR, "shards"))
+
+# watch 模式：已處理檔案與累計統計的狀態檔、探測新季別的間隔（秒）
+WATCH_STATE_PATH: str = os.getenv("WATCH_STATE_PATH", os.path.join(DATA_DIR, "watch_state.json"))
+WATCH_INTERVAL_SEC: float = float(os.getenv("WATCH_INTERVAL_SEC", "600"))
+
+# 是否紀錄 span / counter（輸出 trace.jsonl、metrics.prom）
+TRACE_ENABLED: bool = os.getenv("TRACE_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+
+# 解析後 DataFrame 的記憶體預算（MB），超過就落地到 SPILL_DIR；0 表示不限制
+MEMORY_BUDGET_MB: float = float(os.getenv("MEMORY_BUDGET_MB", "0"))
 
 BASE_URL: str = os.getenv(
     "BASE_URL",
@@ -23,6 +41,32 @@ CITIES: dict[str, str] = {
     "臺中市": "B",
 }
 
+# 內政部實價登錄所有縣市代碼（--all-cities 時使用）
+ALL_CITIES: dict[str, str] = {
+    "臺北市": "A",
+    "臺中市": "B",
+    "基隆市": "C",
+    "臺南市": "D",
+    "高雄市": "E",
+    "新北市": "F",
+    "宜蘭縣": "G",
+    "桃園市": "H",
+    "嘉義市": "I",
+    "新竹縣": "J",
+    "苗栗縣": "K",
+    "南投縣": "M",
+    "彰化縣": "N",
+    "新竹市": "O",
+    "雲林縣": "P",
+    "嘉義縣": "Q",
+    "屏東縣": "T",
+    "花蓮縣": "U",
+    "臺東縣": "V",
+    "金門縣": "W",
+    "澎湖縣": "X",
+    "連江縣": "Z",
+}
+
 TRADE_TYPE: dict[str, str] = {
     "不動產買賣": "A",
     "預售屋買賣": "B",
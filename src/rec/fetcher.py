@@ -1,65 +1,110 @@
 import asyncio
 import os
-import time
 import requests
 import aiohttp
-import time
 from typing import Iterable, Dict, List
 from .config import BASE_URL, DATA_DIR, ensure_directories
+from . import tracing
+from .atomic import atomic_write
 
 DEFAULT_TIMEOUT = 30
 DEFAULT_RETRIES = 3
 DEFAULT_BACKOFF = 1.6 #指數退回
 sem = asyncio.Semaphore(10)
 
+class HtmlResponseError(ValueError):
+    """伺服器回傳 HTML 錯誤頁（例如季別或檔案尚未公布）而不是 CSV"""
+
+def looks_like_html(head: bytes) -> bool:
+    """開頭（去掉 BOM 與空白）是 '<' 就視為 HTML 錯誤頁"""
+    return head.lstrip(b"\xef\xbb\xbf").lstrip().startswith(b"<")
+
 def build_download_url(season: str, file_name: str) -> str:
     """組下載連結：/DownloadSeason?season=YYYYSN&fileName=X_lvr_land_X.csv"""
     return f"{BASE_URL}?season={season}&fileName={file_name}"
 
 def _write_bytes(path: str, content: bytes) -> None:
-    # dirname:取出路徑中的「資料夾部分」，不包含檔案或最後一段名稱
-    # "data/106S1/file.csv" -> "data/106S1"
-    start = time.perf_counter()
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "wb") as f:
-        f.write(content)
-    elapsed_time = time.perf_counter() -start
-    print(f"{[_write_bytes]} took {elapsed_time:.4f} sec") 
+    # 先寫暫存檔再取代：中途被中斷時不會留下寫一半的 CSV，
+    # download_tasks 看到檔案存在就代表它是完整的
+    with tracing.span("write", path=path, bytes=len(content)):
+        with atomic_write(path, "wb") as f:
+            f.write(content)
 
 async def download_file(session: aiohttp.ClientSession, url: str, dest_path: str,
                   *, timeout: int = DEFAULT_TIMEOUT,
                   max_retries: int = DEFAULT_RETRIES,
                   backoff: float = DEFAULT_BACKOFF) -> str:
-    """下載單一檔案，含重試與回退。返回存檔路徑。"""
+    """
+    下載單一檔案，含重試與回退。返回存檔路徑。
+    回應是 HTML 錯誤頁時不存檔、不重試，直接丟出 HtmlResponseError（下次執行再下載）。
+    """
     async with sem:
-        last_err = None
-        for attempt in range(max_retries):
-            try: 
-                async with session.get(url,ssl=False, timeout=timeout, headers={"User-Agent":"Mozilla/5.0"}) as resp:
-                    start = time.perf_counter()   
-                    resp.raise_for_status()
-                    content = await resp.read()
-                    elapsed_time = time.perf_counter() - start
-                    print(f"{[download_file]} took {elapsed_time:.4f} sec")
-                    _write_bytes(dest_path, content)
-                    return dest_path
-            except Exception as e:
-                last_err = e
-                if attempt == max_retries - 1:
-                    print(f"[error] Failed to download {url}: {e}")
-                    raise
-                await asyncio.sleep(backoff ** attempt)
+        with tracing.span("download", url=url) as sp:
+            for attempt in range(max_retries):
+                try: 
+                    async with session.get(url,ssl=False, timeout=timeout, headers={"User-Agent":"Mozilla/5.0"}) as resp:
+                        resp.raise_for_status()
+                        content = await resp.read()
+                        sp.set(bytes=len(content), retries=attempt, status_code=resp.status)
+                        if looks_like_html(content[:512]):
+                            raise HtmlResponseError(f"Got an HTML page instead of CSV: {url}")
+                        tracing.incr("bytes_downloaded", len(content))
+                        tracing.incr("files_downloaded")
+                        _write_bytes(dest_path, content)
+                        return dest_path
+                except Exception as e:
+                    if isinstance(e, HtmlResponseError) or attempt == max_retries - 1:
+                        print(f"[error] Failed to download {url}: {e}")
+                        sp.set(retries=attempt)
+                        tracing.incr("download_failures")
+                        raise
+                    tracing.incr("download_retries")
+                    await asyncio.sleep(backoff ** attempt)
+
+async def probe_season(session: aiohttp.ClientSession, season: str, file_name: str,
+                       *, timeout: int = DEFAULT_TIMEOUT) -> bool:
+    """
+    探測季別是否已公布：回應 200 且開頭不是 HTML（未公布時會回錯誤頁）。
+    只讀開頭幾百個位元組，不下載整個檔案。
+    """
+    url = build_download_url(season, file_name)
+    with tracing.span("probe", url=url) as sp:
+        try:
+            async with session.get(url, ssl=False, timeout=timeout, headers={"User-Agent":"Mozilla/5.0"}) as resp:
+                head = await resp.content.read(512) if resp.status == 200 else b""
+        except Exception as e:
+            print(f"[warn] Failed to probe {url}: {e}")
+            head = b""
+        published = bool(head.strip()) and not looks_like_html(head)
+        sp.set(published=published)
+    tracing.incr("probes", published=published)
+    return published
+
+async def probe_new_seasons(seasons: Iterable[str], file_name: str) -> List[str]:
+    """依序探測 seasons，回傳第一個未公布季別之前的所有季別"""
+    published: List[str] = []
+    async with aiohttp.ClientSession() as session:
+        for season in seasons:
+            if not await probe_season(session, season, file_name):
+                break
+            published.append(season)
+    return published
+
+def _is_html_file(path: str) -> bool:
+    with open(path, "rb") as f:
+        return looks_like_html(f.read(512))
 
 async def download_tasks(tasks: Iterable[Dict], base_dir: str = DATA_DIR) -> List[str]:
     """
     依 manifest 產生的 tasks 逐一下載到：
       {DATA_DIR}/{season}/{file_name}
-    下載存在就略過。
-    回傳所有檔案的本地完整路徑清單。
+    下載存在就略過（之前存下的 HTML 錯誤頁會刪掉重新下載）。
+    回傳所有檔案的本地完整路徑清單（依 tasks 的順序，下載失敗的略過）。
     """
     
     ensure_directories()
-    saved: List[str] = []
+    # 每個 task 對應一個位置：已存在的檔案直接填路徑，其餘等下載結果
+    slots: List = []
     async with aiohttp.ClientSession() as session:
         job_list = []
         for t in tasks:
@@ -67,17 +112,25 @@ async def download_tasks(tasks: Iterable[Dict], base_dir: str = DATA_DIR) -> Lis
             file_name = t["file_name"]
             url = build_download_url(season, file_name)
             dest = os.path.join(base_dir, season, file_name)
+            if os.path.exists(dest) and _is_html_file(dest):
+                print(f"[warn] {dest} 是 HTML 錯誤頁，刪除後重新下載")
+                os.remove(dest)
             if not os.path.exists(dest):
+                slots.append(len(job_list))
                 job_list.append(download_file(session, url, dest))
             else:
-                saved.append(dest)
+                slots.append(dest)
+        results = []
         if job_list:
                 results = await asyncio.gather(*job_list, return_exceptions=True)
                 for r in results:
                     if isinstance(r, Exception):
                         print("[error]", r)
-                    else:
-                        saved.append(r)
+    saved: List[str] = []
+    for slot in slots:
+        r = results[slot] if isinstance(slot, int) else slot
+        if not isinstance(r, Exception):
+            saved.append(r)
     return saved
 # 🧪 測試入口
 if __name__ == "__main__":
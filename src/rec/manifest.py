@@ -25,8 +25,11 @@ manifest.py
 主要函式：
     - generate_tasks(): 依輸入條件生成任務清單
     - season_to_year_quarter(): 解析季別字串為年份與季度
+    - next_season(): 下一個季別（watch 模式探測新季別用）
     - build_file_name(): 依城市代碼與交易代碼產生檔名
     - build_df_name(): 依年份、季度、代碼產生 df_name
+    - parse_shard(): 解析 "i/N" 分片字串
+    - shard_tasks(): 把任務清單穩定、依檔案大小平衡地分給 N 個分片
 
 """
 
@@ -51,15 +54,28 @@ def season_to_year_quarter(season: str) -> tuple[str, int]:
     year = int(year_str)
     quarter = int(quarter_str)
 
-    if not (103 <= year <= 108):
+    # 實價登錄自 101S4 開始公布；之後的季別由 watch 模式探測，不設上限
+    if year < 101:
         raise ValueError(f"Invalid year: {year}")
     if not (1 <= quarter <= 4):
         raise ValueError(f"Invalid quarter: {quarter}")
-    if year == 108 and quarter not in (1, 2):
-        raise ValueError(f"Invalid quarter {quarter} for year 108")
 
     return str(year), quarter
 
+def next_season(season: str) -> str:
+    """
+    '108S2' -> '108S3'，'108S4' -> '109S1'
+    """
+    year, quarter = season_to_year_quarter(season)
+    if quarter == 4:
+        return f"{int(year) + 1}S1"
+    return f"{year}S{quarter + 1}"
+
+def season_key(season: str) -> Tuple[int, int]:
+    """季別排序用：'108S2' -> (108, 2)"""
+    year, quarter = season_to_year_quarter(season)
+    return int(year), quarter
+
 
 def build_file_name(city: str, trade_type: str) -> str:
     if not isinstance(city, str):
@@ -94,9 +110,11 @@ def generate_tasks(
     seasons: Optional[Iterable[str]] = None,
     include_cities: Optional[Iterable[str]] = None,
     include_trade_types: Optional[Iterable[str]] = None,
+    all_cities: bool = False,
 ) -> List[Dict]:
     """
     依題目需求，產生要下載的目標清單（只列 X_lvr_land_X 主檔）。
+    all_cities=True 時，每種交易類型都涵蓋 config.ALL_CITIES 的所有縣市。
     每筆包含：
       - season, year, quarter
       - city_name, city_code
@@ -124,7 +142,7 @@ def generate_tasks(
         for trade_type_name in trade_types:
             trade_code = config.TRADE_TYPE[trade_type_name]
             # 依類型選城市
-            candidate_cities = _cities_for_trade(trade_type_name)
+            candidate_cities = list(config.ALL_CITIES) if all_cities else _cities_for_trade(trade_type_name)
 
             if include_cities:
                 city_set = set(include_cities)
@@ -133,7 +151,7 @@ def generate_tasks(
                     raise ValueError(f"No valid cities found for trade type: {include_cities}")
 
             for city_name in candidate_cities:
-                city_code = config.CITIES[city_name]
+                city_code = config.ALL_CITIES[city_name]
                 file_name = build_file_name(city_code, trade_code)
                 df_name = build_df_name(year, quarter, city_code, trade_code)
 
@@ -149,4 +167,45 @@ def generate_tasks(
                     "df_name": df_name,
                 })
     tasks.sort(key=lambda t: (t["season"], t["trade_code"], t["city_code"]))
-    return tasks
\ No newline at end of file
+    return tasks
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    將 '2/4' -> (2, 4)，分片編號從 1 開始
+    """
+    if not isinstance(shard, str) or "/" not in shard:
+        raise ValueError(f"Invalid shard: {shard}")
+    index_str, count_str = shard.split("/", 1)
+    try:
+        index, count = int(index_str), int(count_str)
+    except ValueError:
+        raise ValueError(f"Invalid shard: {shard}") from None
+    if count < 1 or not (1 <= index <= count):
+        raise ValueError(f"Invalid shard: {shard}")
+    return index, count
+
+def shard_tasks(tasks: List[Dict], index: int, count: int,
+                weights: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """
+    把 tasks 分成 count 份，回傳第 index 份（1 起算），順序與 tasks 相同。
+
+    - 穩定：只依 tasks 與 weights 決定，不同機器算出的結果相同
+    - 平衡：依 weights[file_name]（例如各縣市檔案的平均位元組）由大到小，
+      每次分給目前負載最小的分片（LPT 貪婪法）；沒有權重的檔案視為 1
+    """
+    if count < 1 or not (1 <= index <= count):
+        raise ValueError(f"Invalid shard: {index}/{count}")
+    weights = weights or {}
+
+    def weight(i: int) -> float:
+        return float(weights.get(tasks[i]["file_name"], 1.0))
+
+    loads = [0.0] * count
+    assigned: List[int] = []
+    # 權重相同時依原本順序，確保結果穩定
+    for i in sorted(range(len(tasks)), key=lambda i: (-weight(i), i)):
+        shard = min(range(count), key=lambda s: (loads[s], s))
+        loads[shard] += weight(i)
+        if shard == index - 1:
+            assigned.append(i)
+    return [tasks[i] for i in sorted(assigned)]
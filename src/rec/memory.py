@@ -0,0 +1,148 @@
+"""
+memory.py
+---------
+記憶體用量紀錄與超出預算時的落地（spill-to-disk）工具。
+
+MemoryTracker:
+    - 在每個階段 / 每個檔案呼叫 record()，記下
+      列數、DataFrame 的 memory_usage(deep=True)、目前 RSS 與峰值 RSS
+    - export() 輸出 memory.csv，與 count.csv 放在同一資料夾
+
+FrameSpiller:
+    - 暫存解析後的 DataFrame；當暫存的 DataFrame 總位元組超過預算時，
+      把它們合併後寫成 pickle 檔，釋放記憶體
+    - iter_chunks() 依加入順序逐塊讀回，讓後續的篩選 / 統計可以逐塊處理
+    - 每個 FrameSpiller 在 spill_dir 底下建立自己的暫存資料夾，
+      同一台機器上的多個 worker（例如 --shard）不會互相覆蓋或刪除落地檔
+    - budget_bytes = 0 表示不限制（完全不落地）
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from .config import OUTPUT_DIR, SPILL_DIR
+
+MEMORY_CSV = "memory.csv"
+
+
+def frame_bytes(df: Optional[pd.DataFrame]) -> int:
+    """DataFrame 實際占用的位元組（含字串物件）"""
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
+
+def peak_rss_bytes() -> int:
+    """行程的峰值 RSS（無法取得時回傳 0）"""
+    try:
+        import resource
+    except ImportError:  # Windows 沒有 resource 模組
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位是 KB，macOS 是 bytes
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def current_rss_bytes() -> int:
+    """行程目前的 RSS（優先用 psutil，其次 /proc，都不行就回傳峰值）"""
+    try:
+        import psutil
+        return int(psutil.Process().memory_info().rss)
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return peak_rss_bytes()
+
+
+class MemoryTracker:
+    """依階段 / 檔案紀錄記憶體用量"""
+
+    def __init__(self) -> None:
+        self.records: List[Dict] = []
+
+    def record(self, stage: str, df: Optional[pd.DataFrame] = None, name: str = "") -> Dict:
+        row = {
+            "階段": stage,
+            "對象": name,
+            "列數": 0 if df is None else int(len(df)),
+            "DataFrame位元組": frame_bytes(df),
+            "RSS位元組": current_rss_bytes(),
+            "峰值RSS位元組": peak_rss_bytes(),
+        }
+        self.records.append(row)
+        return row
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records, columns=["階段", "對象", "列數", "DataFrame位元組", "RSS位元組", "峰值RSS位元組"])
+
+    def export(self, out_dir: str = OUTPUT_DIR) -> str:
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, MEMORY_CSV)
+        self.to_frame().to_csv(path, index=False, encoding="utf-8-sig")
+        peak_mb = peak_rss_bytes() / 1024 / 1024
+        print(f"  匯出 memory.csv: {len(self.records)} 筆紀錄，峰值 RSS {peak_mb:.1f} MB")
+        return path
+
+
+class FrameSpiller:
+    """超過記憶體預算時把暫存的 DataFrame 寫到磁碟"""
+
+    def __init__(self, budget_bytes: int = 0, spill_dir: str = SPILL_DIR,
+                 tracker: Optional[MemoryTracker] = None) -> None:
+        self.budget_bytes = int(budget_bytes)
+        self.spill_dir = spill_dir
+        self.tracker = tracker
+        self.buffer: List[pd.DataFrame] = []
+        self.buffer_bytes = 0
+        self.spilled: List[str] = []
+        # 第一次落地時才建立的專屬資料夾
+        self.private_dir: Optional[str] = None
+
+    def add(self, df: pd.DataFrame) -> None:
+        self.buffer.append(df)
+        self.buffer_bytes += frame_bytes(df)
+        if self.budget_bytes and self.buffer_bytes > self.budget_bytes:
+            self.spill()
+
+    def spill(self) -> Optional[str]:
+        """把目前暫存的 DataFrame 合併寫成一個 pickle 檔"""
+        if not self.buffer:
+            return None
+        if self.private_dir is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.private_dir = tempfile.mkdtemp(dir=self.spill_dir, prefix=f"spill-{os.getpid()}-")
+        path = os.path.join(self.private_dir, f"spill_{len(self.spilled):04d}.pkl")
+        chunk = pd.concat(self.buffer, ignore_index=True, sort=False)
+        chunk.to_pickle(path)
+        if self.tracker is not None:
+            self.tracker.record("spill", chunk, name=os.path.basename(path))
+        print(f"  記憶體超過預算，落地 {len(self.buffer)} 個 DataFrame → {path}")
+        self.spilled.append(path)
+        self.buffer = []
+        self.buffer_bytes = 0
+        return path
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """依加入順序逐塊回傳：先讀回已落地的檔案，最後是仍在記憶體中的暫存"""
+        for path in self.spilled:
+            yield pd.read_pickle(path)
+        if self.buffer:
+            yield pd.concat(self.buffer, ignore_index=True, sort=False)
+
+    def cleanup(self) -> None:
+        """刪除自己的落地資料夾（不動其他 worker 的檔案）"""
+        if self.private_dir is not None:
+            shutil.rmtree(self.private_dir, ignore_errors=True)
+            self.private_dir = None
+        self.spilled = []
@@ -4,6 +4,8 @@ from typing import List, Dict, Tuple, Optional
 import pandas as pd
 import numpy as np
 
+from .schema import SchemaRegistry
+
 # 只定義真正需要的欄位
 REQUIRED_FIELDS = {
     "主要用途": "str",      # 篩選條件
@@ -14,24 +16,21 @@ REQUIRED_FIELDS = {
     "交易筆棟數": "float"   # 統計用
 }
 
-def _read_csv_with_utf8(path: str) -> pd.DataFrame:
-    """讀取 CSV（固定使用 UTF-8 編碼）"""
-    return pd.read_csv(path, header=None, dtype=str, encoding="utf-8")
+# 未指定 registry 時使用的行程內快取
+_DEFAULT_REGISTRY = SchemaRegistry()
 
-def _zh_en_mapping(df_raw: pd.DataFrame) -> Dict[str, str]:
-    """
-    由第一列(中文)與第二列(英文)建立對應：中文 -> 英文欄位名
-    """
-    zh = df_raw.iloc[0].fillna('').tolist()
-    en = df_raw.iloc[1].fillna('').tolist()
-    
-    mapping = {}
-    for z, e in zip(zh, en):
-        z_clean = str(z).strip()
-        e_clean = str(e).strip()
-        if z_clean and e_clean and z_clean != 'nan' and e_clean != 'nan':
-            mapping[z_clean] = e_clean
-    return mapping
+def _read_header_rows(path: str) -> pd.DataFrame:
+    """只讀前兩列標題（第一列中文、第二列英文）"""
+    return pd.read_csv(path, header=None, nrows=2, dtype=str, encoding="utf-8")
+
+def _read_planned_columns(path: str, positions: List[int]) -> pd.DataFrame:
+    """跳過兩列標題，只讀解析計畫中需要的欄位（欄名為欄位位置）"""
+    try:
+        return pd.read_csv(path, header=None, skiprows=2, usecols=positions,
+                           dtype=str, encoding="utf-8")
+    except pd.errors.EmptyDataError:
+        # 只有標題、沒有資料
+        return pd.DataFrame(columns=positions, dtype=str)
 
 def _cn_numeral_to_int(s: str) -> int:
     """轉中文數字為整數，失敗則回傳0"""
@@ -69,76 +68,43 @@ def _cn_numeral_to_int(s: str) -> int:
     
     return 0
 
-def read_csv_file(path: str, df_name: str) -> pd.DataFrame:
+def read_csv_file(path: str, df_name: str, registry: Optional[SchemaRegistry] = None) -> pd.DataFrame:
     """
     讀取 MOI CSV，只保留需要的欄位
+    以兩列標題的指紋向 registry 取得解析計畫；已知格式不再處理標題。
+    沒看過且缺少必要欄位的格式會丟出 SchemaDriftError。
     """
-    raw = _read_csv_with_utf8(path)
-    
-    if raw is None or raw.shape[0] < 2:
+    if registry is None:
+        registry = _DEFAULT_REGISTRY
+
+    header = _read_header_rows(path)
+    if header is None or header.shape[0] < 2:
         raise ValueError(f"CSV 結構異常：{path}")
-    
-    zh2en = _zh_en_mapping(raw)
-    
-    # 取出資料部分（跳過前兩列標題）
-    data_df = raw.iloc[2:].reset_index(drop=True)
-    
-    # 設定英文標題為欄位名（處理空值和無效值）
-    en_header_raw = raw.iloc[1].tolist()
-    en_header = []
-    for i, col in enumerate(en_header_raw):
-        #pd.isna(col) 檢查這個值是不是 缺失值
-        if pd.isna(col) or str(col).strip() == '' or str(col).strip() == 'nan':
-            en_header.append(f'col_{i}')
-        else:
-            en_header.append(str(col).strip())
-    
-    seen = {}
-    unique_header = []
-    for col in en_header:
-        if col in seen:
-            seen[col] += 1
-            unique_header.append(f"{col}_{seen[col]}")
-        else:
-            seen[col] = 0
-            unique_header.append(col)
-    
-    # 加上 [:len(data_df.columns)] 是為了避免欄位數超過實際 DataFrame 的欄數。
-    data_df.columns = unique_header[:len(data_df.columns)]
-    
-    # **關鍵優化：只保留需要的欄位**
+
+    plan = registry.get_plan(header.iloc[0].tolist(), header.iloc[1].tolist(),
+                             REQUIRED_FIELDS, source=path)
+    columns = plan["columns"]
+    positions = sorted({c["position"] for c in columns.values()})
+    data_df = _read_planned_columns(path, positions)
+
     result_data = {"df_name": df_name}
-    
+
     for cn_field, field_type in REQUIRED_FIELDS.items():
-        en_field = zh2en.get(cn_field)
-        
-        if en_field and en_field in data_df.columns:
-            # .fillna('')把這欄裡的缺失值（NaN / None）填補成空字串 ''
-            raw_data = data_df[en_field].fillna('').astype(str)
-            
-            if field_type == "float":
-                
-                cleaned_data = raw_data.str.replace(',', '', regex=False)
-                cleaned_data = cleaned_data.replace(['', 'nan', 'None'], '0')
-                # errors="coerce" → 若遇到非法值（如 "abc", "N/A"），不丟出錯誤，而是轉成 NaN
-                result_data[cn_field] = pd.to_numeric(cleaned_data, errors='coerce').fillna(0.0)
-            else:
-                result_data[cn_field] = raw_data.replace(['nan', 'None'], '')
+        # .fillna('')把這欄裡的缺失值（NaN / None）填補成空字串 ''
+        raw_data = data_df[columns[cn_field]["position"]].fillna('').astype(str)
+
+        if field_type == "float":
+            cleaned_data = raw_data.str.replace(',', '', regex=False)
+            cleaned_data = cleaned_data.replace(['', 'nan', 'None'], '0')
+            # errors="coerce" → 若遇到非法值（如 "abc", "N/A"），不丟出錯誤，而是轉成 NaN
+            result_data[cn_field] = pd.to_numeric(cleaned_data, errors='coerce').fillna(0.0)
         else:
-            # 如果原始資料中，REQUIRED_FIELDS欄位不存在，設定預設值
-            row_count = len(data_df)
-            if field_type == "float":
-                result_data[cn_field] = [0.0] * row_count
-            else:
-                result_data[cn_field] = [''] * row_count
-    
+            result_data[cn_field] = raw_data.replace(['nan', 'None'], '')
+
     # 建立新的 DataFrame（只包含需要的欄位）
     result_df = pd.DataFrame(result_data)
     
     # 處理樓層數轉換
-    if "總樓層數" in result_df.columns:
-        result_df["總樓層數_數值"] = result_df["總樓層數"].apply(_cn_numeral_to_int)
-    else:
-        result_df["總樓層數_數值"] = 0
+    result_df["總樓層數_數值"] = result_df["總樓層數"].apply(_cn_numeral_to_int)
     
-    return result_df
\ No newline at end of file
+    return result_df
@@ -1,112 +1,262 @@
 from __future__ import annotations
+import argparse
 import asyncio
 import os
-import time
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 
-from . import config
-from .manifest import generate_tasks
+from . import config, tracing
+from .manifest import generate_tasks, parse_shard, shard_tasks
 from .fetcher import download_tasks
 from .parser_cleaner import read_csv_file
-from .combiner import combine_all, apply_filters, aggregate_counts, export_results
-from .sink_es import push_dataframe_to_es
+from .combiner import (combine_all, apply_filters, aggregate_counts, export_results,
+                       update_sketches, export_sketches)
+from .sink_es import push_dataframe_to_es, row_doc_ids
+from .memory import MemoryTracker, FrameSpiller
+from .schema import SchemaRegistry, SchemaDriftError
+from .shard import shard_dir, load_weights, write_partial, reduce_partials
 
-async def run(all_seasons: bool = True) -> None:
+def parse_paths(paths: List[str], dfname_map: Dict, registry: SchemaRegistry,
+                tracker: MemoryTracker, spiller: FrameSpiller) -> List[str]:
+    """
+    讀取與清理每個 CSV，結果交給 spiller 暫存（超過預算會落地）。
+    回傳成功讀取的檔案 df_name 清單。
+    """
+    parsed: List[str] = []
+    for p in paths:
+        file_name = os.path.basename(p)
+        season = os.path.basename(os.path.dirname(p))
+        df_name = dfname_map.get((season, file_name), None) or "UNKNOWN"
+        try:
+            with tracing.span("parse", file=p, df_name=df_name) as sp:
+                # 檢查檔案大小
+                file_size = os.path.getsize(p)
+                df = read_csv_file(p, df_name=df_name, registry=registry)
+                sp.set(bytes=file_size, rows=len(df))
+            tracing.incr("rows_parsed", len(df))
+            tracing.incr("bytes_parsed", file_size)
+            
+            tracker.record("parse", df, name=df_name)
+            spiller.add(df)
+            parsed.append(df_name)
+            
+        except SchemaDriftError as e:
+            # 標題格式變了：明確略過，不用預設值補 0
+            print(f"[WARN] {e}")
+            tracing.incr("schema_drift")
+            continue
+        except Exception as e:
+            print(f"[WARN] 讀取失敗 {p}: {e}")
+            tracing.incr("parse_failures")
+            continue
+
+    if registry.drift:
+        print(f"[WARN] 發現 {len(registry.drift)} 個新的欄位格式（schema drift）")
+    registry.save()
+    return parsed
+
+def filter_parsed(spiller: FrameSpiller, tracker: MemoryTracker) -> pd.DataFrame:
+    """合併並篩選 spiller 中的 DataFrame"""
+    if spiller.spilled:
+        # 已落地：逐塊讀回並篩選，只合併篩選後的結果（篩選是逐列判斷，結果與整批相同）
+        print(f"開始逐塊篩選 {len(spiller.spilled)} 個落地檔案...")
+        parts: List[pd.DataFrame] = []
+        for chunk in spiller.iter_chunks():
+            with tracing.span("filter", rows_in=len(chunk)) as sp:
+                tracker.record("combine", chunk, name="chunk")
+                parts.append(apply_filters(chunk))
+                sp.set(rows_out=len(parts[-1]))
+            del chunk
+        with tracing.span("combine", frames=len(parts)) as sp:
+            filtered = combine_all(parts)
+            sp.set(rows=len(filtered))
+    else:
+        print("開始合併 DataFrame...")
+        with tracing.span("combine", frames=len(spiller.buffer)) as sp:
+            combined = combine_all(spiller.buffer)
+            sp.set(rows=len(combined))
+        # 合併後就不再需要個別的 DataFrame
+        spiller.buffer = []
+        print(f"合併成功：{combined.shape}")
+        tracker.record("combine", combined)
+
+        with tracing.span("filter", rows_in=len(combined)) as sp:
+            filtered = apply_filters(combined)
+            sp.set(rows_out=len(filtered))
+        del combined
+    print(f"篩選後：{filtered.shape}")
+    tracker.record("filter", filtered)
+    tracing.incr("rows_filtered", len(filtered))
+    return filtered
+
+def export_outputs(filtered: pd.DataFrame, tracker: MemoryTracker, out_dir: str) -> None:
+    """統計並輸出 filter.csv / count.csv / quantile.csv / histogram.csv"""
+    with tracing.span("aggregate", rows=len(filtered)):
+        counts = aggregate_counts(filtered)
+        # 分位數與直方圖（串流草圖）
+        sketches = update_sketches(filtered)
+    tracker.record("aggregate", counts)
+
+    with tracing.span("export", rows=len(filtered)):
+        filter_path, count_path = export_results(filtered, counts, out_dir=out_dir)
+        quantile_path, histogram_path = export_sketches(sketches, out_dir=out_dir)
+    tracker.record("export", filtered)
+    for path in (filter_path, count_path, quantile_path, histogram_path):
+        print(f"[OK] 輸出: {path}")
+
+def push_es(filtered: pd.DataFrame, tracker: MemoryTracker, raise_errors: bool = False) -> None:
+    """
+    （可選）寫入 Elasticsearch（ES_HOST 為空字串時略過）
+    文件 id 由 df_name + 序號決定，重寫同一批資料不會產生重複文件。
+    raise_errors=True 時寫入失敗會往上丟，讓呼叫端不要記錄為已完成。
+    """
+    es_host = os.getenv("ES_HOST", "http://localhost:9200").strip()
+    es_index = os.getenv("ES_INDEX", "land_filter").strip()
+
+    if es_host:
+        try:
+            with tracing.span("es", index=es_index, rows=len(filtered)):
+                ok = push_dataframe_to_es(filtered, index=es_index, es_host=es_host,
+                                          doc_ids=row_doc_ids(filtered) if len(filtered) else None)
+            print(f"[OK] 已寫入 Elasticsearch：{ok} 筆（index={es_index}）")
+        except Exception as e:
+            print(f"[WARN] 寫入 ES 失敗：{e}")
+            if raise_errors:
+                raise
+        tracker.record("es", filtered)
+
+async def run(all_seasons: bool = True, memory_budget_mb: Optional[float] = None,
+              trace: Optional[bool] = None, all_cities: bool = False,
+              shard: Optional[Tuple[int, int]] = None) -> None:
     """
     主流程：
       1) 產生任務清單（只含 X_lvr_land_X 主檔）
       2) 下載 CSV 至 {DATA_DIR}/{season}/
       3) 讀取每個 CSV：用第二列英文為欄位名 + 加 df_name + 數值清理
-      4) 合併、篩選、輸出 filter.csv / count.csv
+      4) 合併、篩選、輸出 filter.csv / count.csv / quantile.csv / histogram.csv
       5) （可選）寫入 Elasticsearch（若 .env 設定了 ES_HOST）
+
+    每個階段 / 檔案的記憶體用量輸出到 memory.csv。
+    memory_budget_mb（預設讀 config.MEMORY_BUDGET_MB）> 0 時，
+    解析後的 DataFrame 超過預算就落地到 config.SPILL_DIR，之後逐塊讀回篩選。
+    trace（預設讀 config.TRACE_ENABLED）為 True 時輸出 trace.jsonl 與 metrics.prom。
+
+    shard=(i, N) 時只處理第 i 個分片的任務，步驟 4) 改為把部分結果寫到
+    {SHARD_DIR}/shard-i-of-N/，不寫 ES；全部分片完成後再呼叫 reduce_shards(N)。
     """
+    # trace 只影響這次執行，結束後還原原本的設定
+    was_enabled = tracing.tracer.enabled
+    if trace is not None:
+        tracing.tracer.enabled = trace
+    out_dir = shard_dir(*shard, base_dir=config.SHARD_DIR) if shard else config.OUTPUT_DIR
+    try:
+        with tracing.span("run", all_seasons=all_seasons, shard=f"{shard[0]}/{shard[1]}" if shard else None):
+            await _run(all_seasons, memory_budget_mb, all_cities, shard, out_dir)
+    finally:
+        if tracing.tracer.enabled:
+            tracing.tracer.export(out_dir=out_dir)
+        # 下一次執行的 trace.jsonl 不再包含這次的 span，記憶體也不會隨執行次數增加
+        tracing.tracer.drop_spans()
+        tracing.tracer.enabled = was_enabled
+
+async def _run(all_seasons: bool, memory_budget_mb: Optional[float], all_cities: bool,
+               shard: Optional[Tuple[int, int]], out_dir: str) -> None:
     config.ensure_directories()
 
     seasons = config.SEASONS if all_seasons else config.SEASONS[:1] 
     
-    tasks = generate_tasks(seasons=seasons)
+    with tracing.span("manifest", seasons=len(seasons)) as sp:
+        all_tasks = generate_tasks(seasons=seasons, all_cities=all_cities)
+        tasks = all_tasks
+        weights = None
+        if shard:
+            # 依上次 reduce 留下的檔案大小平衡分片；權重會記進部分結果，reduce 時檢查各分片一致
+            weights = load_weights(config.SHARD_DIR)
+            tasks = shard_tasks(all_tasks, *shard, weights=weights)
+        sp.set(tasks=len(tasks))
 
     # 2) 下載
-    t0 = time.perf_counter()
-    paths = await download_tasks(tasks, base_dir=config.DATA_DIR)
-    print(f"整個 fetcher.py 總耗時: {time.perf_counter() - t0:.2f} 秒")
+    with tracing.span("fetch", tasks=len(tasks)) as sp:
+        paths = await download_tasks(tasks, base_dir=config.DATA_DIR)
+        sp.set(files=len(paths))
+
+    budget_mb = config.MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb
+    tracker = MemoryTracker()
+    spiller = FrameSpiller(budget_bytes=int(budget_mb * 1024 * 1024), spill_dir=config.SPILL_DIR, tracker=tracker)
+    tracker.record("download", name=f"{len(paths)} files")
 
     # 建 df_name 查表： (season, file_name) -> df_name
     dfname_map = {(t["season"], t["file_name"]): t["df_name"] for t in tasks}
 
-    # 3) 讀取與清理 - 加入除錯
-    dfs: List[pd.DataFrame] = []
-    for i, p in enumerate(paths):
-        try:
-            
-            # 檢查檔案大小
-            file_size = os.path.getsize(p)
-            
-            
-            file_name = os.path.basename(p)
-            season = os.path.basename(os.path.dirname(p))
-            df_name = dfname_map.get((season, file_name), None) or "UNKNOWN"
-            
-            df = read_csv_file(p, df_name=df_name)
-            
-            
-            # 檢查是否有重複的欄位名稱
-            duplicated_cols = df.columns.duplicated()
-            if duplicated_cols.any():
-                # 處理重複欄位：加上後綴
-                df.columns = [f"{col}_{i}" if dup else col for i, (col, dup) in enumerate(zip(df.columns, duplicated_cols))]
-            
-            dfs.append(df)
-            
-        except Exception as e:
-            # 檢查檔案內容的前幾行
-            try:
-                with open(p, 'r', encoding='utf-8') as f:
-                    first_lines = [f.readline() for _ in range(3)]
-            except Exception as read_err:
-                print(f"  無法讀取檔案內容: {read_err}")
-            continue
-
-    if not dfs:
+    # 3) 讀取與清理
+    # 欄位格式登錄表：已知的標題格式直接套用快取的解析計畫
+    registry = SchemaRegistry(config.SCHEMA_REGISTRY_PATH)
+    if not parse_paths(paths, dfname_map, registry, tracker, spiller) and not shard:
         print("錯誤：沒有成功讀取任何檔案")
         return
 
-    
-    # 在合併前再次檢查每個 DataFrame
-    for i, df in enumerate(dfs):
-        print(f"DataFrame {i}: shape={df.shape}, columns={len(df.columns)}")
-        if df.columns.duplicated().any():
-            print(f"  仍有重複欄位: {df.columns[df.columns.duplicated()].tolist()}")
-
     # 4) 合併 / 篩選 / 輸出 CSV
     try:
-        print("開始合併 DataFrame...")
-        combined = combine_all(dfs)
-        print(f"合併成功：{combined.shape}")
-        
-        filtered = apply_filters(combined)
-        print(f"篩選後：{filtered.shape}")
-        
-        counts = aggregate_counts(filtered)
-        filter_path, count_path = export_results(filtered, counts, out_dir=config.OUTPUT_DIR)
-        print(f"[OK] 輸出: {filter_path}")
-        print(f"[OK] 輸出: {count_path}")
+        filtered = filter_parsed(spiller, tracker)
+
+        if shard:
+            # 分片：只寫部分結果，由 reduce_shards 合併與寫 ES
+            file_sizes = {dfname_map[(os.path.basename(os.path.dirname(p)), os.path.basename(p))]: os.path.getsize(p)
+                          for p in paths}
+            with tracing.span("export", rows=len(filtered)):
+                write_partial(filtered, *shard, tasks, all_tasks, file_sizes, weights=weights,
+                              base_dir=config.SHARD_DIR)
+            return
+
+        export_outputs(filtered, tracker, out_dir=out_dir)
 
         # 5) 寫入 ES 
-        es_host = os.getenv("ES_HOST", "http://localhost:9200").strip()
-        es_index = os.getenv("ES_INDEX", "land_filter").strip()
-
-        if es_host:
-            try:
-                ok = push_dataframe_to_es(filtered, index=es_index, es_host=es_host)
-                print(f"[OK] 已寫入 Elasticsearch：{ok} 筆（index={es_index}）")
-            except Exception as e:
-                print(f"[WARN] 寫入 ES 失敗：{e}")
+        push_es(filtered, tracker)
                 
     except Exception as e:
         print(f"合併失敗: {e}")
         return
+    finally:
+        spiller.cleanup()
+        tracker.export(out_dir=out_dir)
+
+def reduce_shards(count: int) -> None:
+    """
+    合併 N 個分片的部分結果，輸出與單機執行相同的
+    filter.csv / count.csv / quantile.csv / histogram.csv，並寫入 ES。
+    """
+    tracker = MemoryTracker()
+    with tracing.span("reduce", shards=count) as sp:
+        filtered = reduce_partials(count, base_dir=config.SHARD_DIR)
+        sp.set(rows=len(filtered))
+    tracker.record("reduce", filtered)
+    export_outputs(filtered, tracker, out_dir=config.OUTPUT_DIR)
+    push_es(filtered, tracker)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m rec.runner", description="實價登錄 ETL 流程")
+    parser.add_argument("--first-season", action="store_true", help="只處理第一個季別")
+    parser.add_argument("--all-cities", action="store_true", help="每種交易類型都涵蓋所有縣市")
+    parser.add_argument("--shard", metavar="i/N", help="只處理第 i 個分片（1 起算），部分結果寫到 SHARD_DIR")
+    parser.add_argument("--reduce", type=int, metavar="N", help="合併 N 個分片的部分結果")
+    parser.add_argument("--memory-budget-mb", type=float, default=None, help="解析後 DataFrame 的記憶體預算")
+    parser.add_argument("--trace", action="store_true", default=None, help="輸出 trace.jsonl 與 metrics.prom")
+    args = parser.parse_args(argv)
+
+    if args.trace is not None:
+        tracing.tracer.enabled = args.trace
+
+    if args.reduce:
+        try:
+            reduce_shards(args.reduce)
+        finally:
+            if tracing.tracer.enabled:
+                tracing.tracer.export(out_dir=config.OUTPUT_DIR)
+        return
+
+    shard = parse_shard(args.shard) if args.shard else None
+    asyncio.run(run(all_seasons=not args.first_season, memory_budget_mb=args.memory_budget_mb,
+                    all_cities=args.all_cities, shard=shard))
 
 if __name__ == "__main__":
-    asyncio.run(run(all_seasons=True))
\ No newline at end of file
+    main()
@@ -0,0 +1,156 @@
+"""
+schema.py
+---------
+欄位格式（schema）登錄表：以兩列標題（中文 / 英文）的指紋快取「解析計畫」。
+
+同一交易類型的檔案只有少數幾種標題格式，因此：
+    - fingerprint_header(): 以兩列標題算出 SHA-1 指紋
+    - compile_plan():       由標題找出每個必要欄位的欄位位置與型別（只做一次）
+    - SchemaRegistry:       指紋 -> 解析計畫；已知格式直接套用，跳過所有標題處理
+                            沒看過的格式記為 schema drift；
+                            若缺少必要欄位則丟出 SchemaDriftError，而不是默默補 0
+                            已知格式的計畫若沒涵蓋目前的必要欄位（例如新增了欄位），
+                            會以目前的必要欄位重新編譯
+
+解析計畫（dict，可存成 JSON）：
+    {
+        "fingerprint": "…",
+        "n_columns": 28,
+        "columns": {"總價元": {"position": 21, "dtype": "float"}, ...},
+    }
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Sequence
+
+from .atomic import atomic_write
+
+
+class SchemaDriftError(ValueError):
+    """標題格式與必要欄位不符"""
+
+
+def _clean_header(row: Sequence) -> List[str]:
+    """標題列清理：去空白，NaN / None / 'nan' 一律視為空字串"""
+    out = []
+    for v in row:
+        s = "" if v is None else str(v).strip()
+        out.append("" if s in ("nan", "None") else s)
+    return out
+
+
+def fingerprint_header(zh: Sequence, en: Sequence) -> str:
+    """兩列標題的指紋（欄位順序、名稱任一不同，指紋就不同）"""
+    zh_clean = _clean_header(zh)
+    en_clean = _clean_header(en)
+    payload = "\x1f".join(zh_clean) + "\x1e" + "\x1f".join(en_clean)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def fingerprint_fields(required_fields: Dict[str, str]) -> str:
+    """必要欄位（名稱與型別）的指紋；REQUIRED_FIELDS 改變時指紋就不同"""
+    payload = json.dumps(required_fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def compile_plan(zh: Sequence, en: Sequence, required_fields: Dict[str, str]) -> Dict:
+    """
+    由中文 / 英文標題編譯解析計畫：
+      1) 中文 -> 英文對應（兩者都非空才算，重複的中文以後者為準）
+      2) 英文欄位以第一次出現的位置為準
+    找不到的必要欄位不會出現在 columns，並列在 missing。
+    """
+    zh_clean = _clean_header(zh)
+    en_clean = _clean_header(en)
+
+    zh2en: Dict[str, str] = {}
+    for z, e in zip(zh_clean, en_clean):
+        if z and e:
+            zh2en[z] = e
+
+    first_position: Dict[str, int] = {}
+    for i, e in enumerate(en_clean):
+        if e and e not in first_position:
+            first_position[e] = i
+
+    columns: Dict[str, Dict] = {}
+    missing: List[str] = []
+    for cn_field, field_type in required_fields.items():
+        en_field = zh2en.get(cn_field)
+        if en_field in first_position:
+            columns[cn_field] = {"position": first_position[en_field], "dtype": field_type}
+        else:
+            missing.append(cn_field)
+
+    return {
+        "fingerprint": fingerprint_header(zh, en),
+        "n_columns": len(en_clean),
+        "columns": columns,
+        "missing": missing,
+    }
+
+
+def _covers(plan: Dict, required_fields: Dict[str, str]) -> bool:
+    """計畫是否涵蓋所有必要欄位，且型別相同"""
+    columns = plan.get("columns", {})
+    return all(columns.get(field, {}).get("dtype") == field_type
+               for field, field_type in required_fields.items())
+
+
+class SchemaRegistry:
+    """指紋 -> 解析計畫 的快取，可存成 JSON 檔供下次執行使用"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.plans: Dict[str, Dict] = {}
+        # 本次執行遇到的新格式：{"fingerprint", "source", "missing"}
+        self.drift: List[Dict] = []
+        self.hits = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def get_plan(self, zh: Sequence, en: Sequence, required_fields: Dict[str, str],
+                 source: str = "") -> Dict:
+        fp = fingerprint_header(zh, en)
+        plan = self.plans.get(fp)
+        if plan is not None and _covers(plan, required_fields):
+            self.hits += 1
+            return plan
+
+        stale = plan is not None
+        plan = compile_plan(zh, en, required_fields)
+        self.drift.append({"fingerprint": fp, "source": source, "missing": plan["missing"]})
+        if plan["missing"]:
+            raise SchemaDriftError(f"Schema drift in {source or fp}: missing {plan['missing']}")
+
+        if stale:
+            print(f"  [WARN] 欄位格式 {fp[:12]} 的計畫未涵蓋目前的必要欄位（{source}），已重新編譯")
+        else:
+            print(f"  [WARN] 新的欄位格式 {fp[:12]}（{source}），已加入登錄表")
+        self.plans[fp] = plan
+        return plan
+
+    def load(self) -> None:
+        """讀取登錄表；檔案損毀時視為空的登錄表（已知格式會重新編譯）"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                plans = json.load(f)
+            if not isinstance(plans, dict):
+                raise ValueError(f"expected an object, got {type(plans).__name__}")
+        except ValueError as e:  # JSONDecodeError 也是 ValueError
+            print(f"  [WARN] 欄位格式登錄表損毀，改用空的登錄表：{self.path}（{e}）")
+            plans = {}
+        self.plans = plans
+
+    def save(self, path: Optional[str] = None) -> Optional[str]:
+        path = path or self.path
+        if not path:
+            return None
+        # 多個行程同時寫入也不會留下寫一半的檔案
+        with atomic_write(path) as f:
+            json.dump(self.plans, f, ensure_ascii=False, indent=2)
+        return path
@@ -0,0 +1,180 @@
+"""
+shard.py
+--------
+分片（shard）執行的部分結果與合併（reduce）。
+
+每個 worker 處理 manifest.shard_tasks() 分到的任務，並在共用資料夾
+{SHARD_DIR}/shard-{i}-of-{N}/ 寫入：
+    - filter.pkl:   該分片篩選後的資料（pickle，保留型別）
+    - partial.json: 完整任務清單與分片權重的指紋、該分片任務的全域順序、檔案大小、
+                    部分統計（件數、車位數）與分位數草圖
+
+reduce_partials() 確認 N 個分片都到齊、來自同一份任務清單與同一組權重，
+且所有分片的任務合起來恰好涵蓋完整任務清單各一次後，
+依全域任務順序合併篩選結果，因此交給 combiner 輸出的
+filter.csv / count.csv / quantile.csv / histogram.csv 與單機執行完全相同；
+各分片的部分統計與草圖則用來交叉檢查合併結果。
+
+reduce 也會把各檔案大小寫成 sizes.json，下次分片時作為平衡用的權重。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .atomic import atomic_write
+from .combiner import aggregate_counts, combine_all, merge_sketches, update_sketches
+from .config import SHARD_DIR
+from .sketch import LogHistogram
+
+PARTIAL_JSON = "partial.json"
+PARTIAL_FILTER = "filter.pkl"
+SIZES_JSON = "sizes.json"
+
+
+def shard_dir(index: int, count: int, base_dir: str = SHARD_DIR) -> str:
+    return os.path.join(base_dir, f"shard-{index}-of-{count}")
+
+
+def manifest_fingerprint(tasks: List[Dict]) -> str:
+    """完整任務清單的指紋，確保所有分片切的是同一份清單"""
+    payload = "\n".join(t["df_name"] for t in tasks)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def weights_fingerprint(weights: Optional[Dict[str, float]]) -> str:
+    """分片權重的指紋；各 worker 的權重不同時，切出來的分片會重疊或漏掉任務"""
+    payload = json.dumps(weights or {}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def load_weights(base_dir: str = SHARD_DIR) -> Dict[str, float]:
+    """讀取上次 reduce 留下的 sizes.json（file_name -> 平均位元組），沒有就回傳空 dict"""
+    path = os.path.join(base_dir, SIZES_JSON)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_partial(filtered: pd.DataFrame, index: int, count: int,
+                  shard_task_list: List[Dict], all_tasks: List[Dict],
+                  file_sizes: Dict[str, int], weights: Optional[Dict[str, float]] = None,
+                  base_dir: str = SHARD_DIR) -> str:
+    """
+    寫入單一分片的部分結果，回傳分片資料夾。
+    file_sizes: df_name -> 檔案位元組（只含成功下載的檔案）
+    weights:    切分片時使用的權重（shard_tasks 的 weights）
+    """
+    out = shard_dir(index, count, base_dir)
+    os.makedirs(out, exist_ok=True)
+
+    global_order = {t["df_name"]: i for i, t in enumerate(all_tasks)}
+    counts = aggregate_counts(filtered).iloc[0].to_dict()
+    sketches = update_sketches(filtered)
+
+    partial = {
+        "shard": index,
+        "count": count,
+        "manifest": manifest_fingerprint(all_tasks),
+        "weights": weights_fingerprint(weights),
+        "n_tasks": len(all_tasks),
+        "order": {t["df_name"]: global_order[t["df_name"]] for t in shard_task_list},
+        "sizes": {t["df_name"]: [t["file_name"], file_sizes[t["df_name"]]]
+                  for t in shard_task_list if t["df_name"] in file_sizes},
+        "counts": {k: (v.item() if hasattr(v, "item") else v) for k, v in counts.items()},
+        "sketches": {field: sk.to_dict() for field, sk in sketches.items()},
+    }
+
+    # 先寫資料再寫 partial.json，reduce 看到 partial.json 就代表該分片已完成
+    filtered.to_pickle(os.path.join(out, PARTIAL_FILTER))
+    with atomic_write(os.path.join(out, PARTIAL_JSON)) as f:
+        json.dump(partial, f, ensure_ascii=False)
+
+    print(f"  分片 {index}/{count}: {len(shard_task_list)} 個任務，篩選後 {len(filtered)} 筆 → {out}")
+    return out
+
+
+def _load_partial(index: int, count: int, base_dir: str) -> Tuple[Dict, pd.DataFrame]:
+    out = shard_dir(index, count, base_dir)
+    with open(os.path.join(out, PARTIAL_JSON), "r", encoding="utf-8") as f:
+        partial = json.load(f)
+    return partial, pd.read_pickle(os.path.join(out, PARTIAL_FILTER))
+
+
+def reduce_partials(count: int, base_dir: str = SHARD_DIR) -> pd.DataFrame:
+    """
+    合併 N 個分片的部分結果，回傳依全域任務順序排列的篩選結果。
+    分片缺少、任務清單不一致或部分統計對不上時丟出 ValueError。
+    """
+    missing = [i for i in range(1, count + 1)
+               if not os.path.exists(os.path.join(shard_dir(i, count, base_dir), PARTIAL_JSON))]
+    if missing:
+        raise ValueError(f"Missing shards: {missing} of {count}")
+
+    partials: List[Dict] = []
+    frames: List[pd.DataFrame] = []
+    for i in range(1, count + 1):
+        partial, df = _load_partial(i, count, base_dir)
+        partials.append(partial)
+        frames.append(df)
+
+    manifests = {p["manifest"] for p in partials}
+    if len(manifests) != 1:
+        raise ValueError(f"Shards were built from different manifests: {sorted(manifests)}")
+    weight_sets = {p["weights"] for p in partials}
+    if len(weight_sets) != 1:
+        raise ValueError(f"Shards were built with different weights: {sorted(weight_sets)}")
+
+    # 所有分片的任務合起來必須恰好是完整任務清單，每個任務各一次
+    order: Dict[str, int] = {}
+    for p in partials:
+        overlap = sorted(set(order) & set(p["order"]))
+        if overlap:
+            raise ValueError(f"Tasks assigned to more than one shard: {overlap}")
+        order.update(p["order"])
+    n_tasks = partials[0]["n_tasks"]
+    ordered = sorted(order, key=order.get)
+    if (sorted(order.values()) != list(range(n_tasks))
+            or manifest_fingerprint([{"df_name": name} for name in ordered]) != manifests.pop()):
+        raise ValueError(f"Shards cover {len(order)} of {n_tasks} tasks")
+
+    # 依全域任務順序排列（同一檔案內維持原本順序）
+    non_empty = [df for df in frames if len(df)]
+    combined = combine_all(non_empty or [df for df in frames if len(df.columns)][:1])
+    if len(combined):
+        key = combined["df_name"].map(order)
+        combined = combined.iloc[key.argsort(kind="stable")].reset_index(drop=True)
+
+    # 以部分統計交叉檢查
+    total = sum(int(p["counts"]["總件數"]) for p in partials)
+    if total != len(combined):
+        raise ValueError(f"Partial counts ({total}) do not match merged rows ({len(combined)})")
+    sketches = merge_sketches(
+        {field: LogHistogram.from_dict(d) for field, d in p["sketches"].items()} for p in partials
+    )
+    for field, sk in sketches.items():
+        if sk.count != len(combined):
+            raise ValueError(f"Sketch {field} count ({sk.count}) does not match merged rows ({len(combined)})")
+
+    _write_sizes(partials, base_dir)
+    return combined
+
+
+def _write_sizes(partials: List[Dict], base_dir: str) -> Optional[str]:
+    """把各檔案大小彙整成 file_name -> 平均位元組，作為下次分片的權重"""
+    totals: Dict[str, List[int]] = {}
+    for p in partials:
+        for file_name, size in p["sizes"].values():
+            totals.setdefault(file_name, []).append(int(size))
+    if not totals:
+        return None
+    path = os.path.join(base_dir, SIZES_JSON)
+    with atomic_write(path) as f:
+        json.dump({k: sum(v) / len(v) for k, v in sorted(totals.items())}, f, ensure_ascii=False, indent=2)
+    return path
@@ -1,15 +1,27 @@
 from __future__ import annotations
-from typing import Iterable, Dict, Any, Optional
+from typing import Iterable, Dict, Any, List, Optional
 import math
 
+from . import tracing
+
+def row_doc_ids(df) -> List[str]:
+    """
+    每列的固定文件 id：df_name + 該列在同一檔案篩選結果中的序號，例如 "106_1_A_A_0"。
+    同一個檔案重新處理時 id 相同，重寫只會覆蓋、不會產生重複文件。
+    """
+    seq = df.groupby("df_name", sort=False).cumcount()
+    return [f"{name}_{n}" for name, n in zip(df["df_name"], seq)]
+
 def push_dataframe_to_es(df, *, index: str, es_host: str,
                          username: Optional[str] = None,
                          password: Optional[str] = None,
                          verify_certs: bool = False,
-                         batch_size: int = 1000) -> int:
+                         batch_size: int = 1000,
+                         doc_ids: Optional[Iterable[str]] = None) -> int:
     """
     將 DataFrame 批次寫入 Elasticsearch。
     - 欄位可含中文（ES 支援），Kibana 可直接讀取。
+    - doc_ids 指定每列的 _id（例如 row_doc_ids(df)），未指定時由 ES 產生。
     - 返回成功寫入的文件數。
     """
     try:
@@ -25,6 +37,7 @@ def push_dataframe_to_es(df, *, index: str, es_host: str,
     # 將 DataFrame 轉換為「list of dict」，每一列資料對應一個 dict
     records = df.to_dict(orient="records")
     total = len(records)
+    ids = list(doc_ids) if doc_ids is not None else None
     success = 0
 
     for start in range(0, total, batch_size):
@@ -32,12 +45,21 @@ def push_dataframe_to_es(df, *, index: str, es_host: str,
         chunk = records[start:start + batch_size]
         # _index → Elasticsearch 裡要存到哪個 index（就像資料庫的「表名」）
         # _source → 這筆資料的實際內容
-        actions = ({"_index": index, "_source": rec} for rec in chunk)
+        # _id → 固定的文件 id，重寫時覆蓋同一份文件
+        if ids is None:
+            actions = ({"_index": index, "_source": rec} for rec in chunk)
+        else:
+            actions = ({"_index": index, "_id": doc_id, "_source": rec}
+                       for doc_id, rec in zip(ids[start:start + batch_size], chunk))
         # 呼叫 Elasticsearch 的 bulk API，一次寫入多筆文件
         # - actions: 包含每筆文件的 "_index" 與 "_source"
         # - ok: 成功寫入的文件數
-        # - _: 錯誤資訊 (這裡忽略不用，所以用 "_" 命名)
+        # - errors: 錯誤資訊 (這裡只記錄筆數到 span)
         # - raise_on_error=False: 即使有寫入失敗的文件，也不中斷程式
-        ok, _ = helpers.bulk(es, actions, raise_on_error=False)
+        with tracing.span("es_bulk", index=index, rows=len(chunk)) as sp:
+            ok, errors = helpers.bulk(es, actions, raise_on_error=False)
+            sp.set(ok=ok, errors=len(errors))
+        tracing.incr("es_docs", ok, index=index)
+        tracing.incr("es_batches", index=index)
         success += ok
     return success
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+sketch.py
+---------
+可合併（mergeable）的串流統計草圖，用來計算中位數、p90/p99 與價格直方圖，
+不需要把整份篩選結果排序。
+
+LogHistogram 以對數刻度的固定桶（bucket）累計數值：
+    - 桶 i 涵蓋 (gamma^(i-1), gamma^i]，gamma = (1 + alpha) / (1 - alpha)
+    - 估計值取 2 * gamma^i / (gamma + 1)，
+      因此任一分位數估計值與真實值的「相對誤差 <= alpha」
+    - <= 0 的值（例如沒有車位時的車位總價元 0）另計於零值桶，估計值為 0，誤差為 0
+
+誤差界的比較基準是「下取樣本分位數」：
+    排序後第 floor(q * (n - 1)) 筆，等同 numpy.quantile(..., method="lower")。
+
+用法：
+    - update(values): 逐塊（chunk）加入資料
+    - merge(other):   合併不同檔案 / worker 的結果，合併後與一次性計算完全相同
+    - to_dict() / from_dict(): 序列化，方便跨程序傳遞
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_ALPHA = 0.01  # 分位數相對誤差上限 1%
+
+
+class LogHistogram:
+    """對數刻度固定桶直方圖（DDSketch 式），可串流更新、可合併。"""
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA) -> None:
+        if not (0 < alpha < 1):
+            raise ValueError(f"alpha must be in (0, 1), got {alpha}")
+        self.alpha = float(alpha)
+        self.gamma = (1 + self.alpha) / (1 - self.alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def update(self, values: Iterable[float]) -> "LogHistogram":
+        """加入一批數值（NaN 會被略過）。"""
+        arr = np.asarray(values, dtype=float).ravel()
+        arr = arr[~np.isnan(arr)]
+        if arr.size == 0:
+            return self
+
+        self.count += int(arr.size)
+        self.total += float(arr.sum())
+        lo, hi = float(arr.min()), float(arr.max())
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+        pos = arr[arr > 0]
+        self.zero_count += int(arr.size - pos.size)
+        if pos.size:
+            # 桶編號 = ceil(log_gamma(x))
+            idx = np.ceil(np.log(pos) / self._log_gamma).astype(np.int64)
+            keys, cnts = np.unique(idx, return_counts=True)
+            for k, c in zip(keys.tolist(), cnts.tolist()):
+                self.bins[k] = self.bins.get(k, 0) + c
+        return self
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        """把另一個草圖合併進來（alpha 必須相同）。"""
+        if other.alpha != self.alpha:
+            raise ValueError(f"Cannot merge sketches with different alpha: {self.alpha} != {other.alpha}")
+        for k, c in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0) + c
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        估計第 q 分位數（0 <= q <= 1），相對誤差 <= alpha。
+        空草圖回傳 0。
+        """
+        if not (0 <= q <= 1):
+            raise ValueError(f"q must be in [0, 1], got {q}")
+        if self.count == 0:
+            return 0.0
+
+        rank = int(math.floor(q * (self.count - 1)))
+        if rank < self.zero_count:
+            return 0.0
+
+        seen = self.zero_count
+        for k in sorted(self.bins):
+            seen += self.bins[k]
+            if seen > rank:
+                estimate = 2 * self.gamma ** k / (self.gamma + 1)
+                # 夾在實際最小 / 最大值之間，不會讓誤差變大
+                return float(min(max(estimate, self.min), self.max))
+        return float(self.max)
+
+    def buckets(self) -> List[Tuple[float, float, int]]:
+        """回傳 (下界, 上界, 件數) 清單；零值桶以 (0, 0, n) 表示。"""
+        out: List[Tuple[float, float, int]] = []
+        if self.zero_count:
+            out.append((0.0, 0.0, self.zero_count))
+        for k in sorted(self.bins):
+            out.append((self.gamma ** (k - 1), self.gamma ** k, self.bins[k]))
+        return out
+
+    def to_dict(self) -> Dict:
+        return {
+            "alpha": self.alpha,
+            "bins": {str(k): c for k, c in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LogHistogram":
+        sk = cls(alpha=data["alpha"])
+        sk.bins = {int(k): int(c) for k, c in data["bins"].items()}
+        sk.zero_count = int(data["zero_count"])
+        sk.count = int(data["count"])
+        sk.total = float(data["total"])
+        sk.min = data["min"]
+        sk.max = data["max"]
+        return sk
@@ -0,0 +1,218 @@
+"""
+tracing.py
+----------
+輕量的 span / counter 紀錄層，取代各處零散的 time.perf_counter() + print。
+
+    with tracing.span("parse", file=path) as sp:
+        df = read_csv_file(...)
+        sp.set(rows=len(df))
+    tracing.incr("rows_parsed", len(df))
+
+輸出（與 count.csv 放在同一資料夾）：
+    - trace.jsonl:  每個 span 一行 JSON（名稱、開始時間、耗時、狀態、屬性、父 span）
+    - metrics.prom: Prometheus text format 快照（counter 與各 span 的耗時 summary）
+
+常駐程式（watch）每輪以 export(append=True) 把新的 span 附加到 trace.jsonl 後從記憶體清掉；
+runner.run() 匯出後也會清掉 span，同一行程內多次執行時 trace.jsonl 只含該次的 span。
+counter 與 span 耗時統計另外累計，metrics.prom 仍是整個行程的總計。
+
+關閉時（預設，TRACE_ENABLED=0）span() 回傳共用的 no-op 物件、incr() 直接返回，
+不呼叫計時函式也不配置記憶體，額外成本可忽略。
+"""
+
+from __future__ import annotations
+
+import contextvars
+import itertools
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .config import OUTPUT_DIR, TRACE_ENABLED
+
+TRACE_JSONL = "trace.jsonl"
+METRICS_PROM = "metrics.prom"
+METRIC_PREFIX = "rec"
+
+# 目前所在的 span id（async task 之間各自獨立）
+_current_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("rec_current_span", default=None)
+
+
+class _NoopSpan:
+    """關閉紀錄時使用，所有操作都不做事"""
+
+    def set(self, **attrs) -> "_NoopSpan":
+        return self
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(tracer._ids)
+        self.parent_id: Optional[int] = None
+        self.start = 0.0
+        self.duration = 0.0
+        self.status = "ok"
+        self._t0 = 0.0
+        self._token = None
+
+    def set(self, **attrs) -> "Span":
+        """補上屬性（例如 rows、bytes、retries）"""
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self) -> "Span":
+        self.parent_id = _current_span.get()
+        self._token = _current_span.set(self.span_id)
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.duration = time.perf_counter() - self._t0
+        if exc_type is not None:
+            self.status = "error"
+            self.attrs.setdefault("error", f"{exc_type.__name__}: {exc}")
+        _current_span.reset(self._token)
+        self.tracer._finish(self)
+        return False
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_sec": self.duration,
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+
+
+class Tracer:
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.spans: List[Span] = []
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        # span 名稱 -> [耗時總和, 次數, 錯誤數]；不隨 span 清除
+        self.span_stats: Dict[str, List[float]] = {}
+        self._ids = itertools.count(1)
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def _finish(self, span: Span) -> None:
+        self.spans.append(span)
+        s = self.span_stats.setdefault(span.name, [0.0, 0, 0])
+        s[0] += span.duration
+        s[1] += 1
+        s[2] += span.status == "error"
+
+    def drop_spans(self) -> None:
+        """清掉已匯出的 span（counter 與耗時統計保留）"""
+        self.spans = []
+
+    def reset(self) -> None:
+        self.spans = []
+        self.counters = {}
+        self.span_stats = {}
+
+    def export_jsonl(self, path: str, append: bool = False) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a" if append else "w", encoding="utf-8") as f:
+            for sp in self.spans:
+                f.write(json.dumps(sp.to_dict(), ensure_ascii=False, default=str) + "\n")
+        return path
+
+    def export_prometheus(self, path: str) -> str:
+        lines: List[str] = []
+
+        # counter：依名稱分組輸出
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (n, labels), value in sorted(self.counters.items()):
+                if n == name:
+                    lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+
+        # span 耗時：summary（_sum / _count）與錯誤數
+        stats = self.span_stats
+        if stats:
+            metric = f"{METRIC_PREFIX}_span_duration_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for name, (total, count, _) in sorted(stats.items()):
+                labels = _format_labels((("span", name),))
+                lines.append(f"{metric}_sum{labels} {_format_value(total)}")
+                lines.append(f"{metric}_count{labels} {int(count)}")
+            metric = f"{METRIC_PREFIX}_span_errors_total"
+            lines.append(f"# TYPE {metric} counter")
+            for name, (_, _, errors) in sorted(stats.items()):
+                lines.append(f"{metric}{_format_labels((('span', name),))} {int(errors)}")
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + ("\n" if lines else ""))
+        return path
+
+    def export(self, out_dir: str = OUTPUT_DIR, append: bool = False) -> Tuple[str, str]:
+        """
+        輸出 trace.jsonl 與 metrics.prom。
+        append=True 時把目前的 span 附加到 trace.jsonl 後清掉（counter 與耗時統計保留），
+        供常駐程式每輪呼叫，記憶體不會隨輪數增加。
+        """
+        trace_path = self.export_jsonl(os.path.join(out_dir, TRACE_JSONL), append=append)
+        metrics_path = self.export_prometheus(os.path.join(out_dir, METRICS_PROM))
+        print(f"  匯出 trace.jsonl: {len(self.spans)} 個 span")
+        print(f"  匯出 metrics.prom: {len(self.counters)} 個 counter")
+        if append:
+            self.drop_spans()
+        return trace_path, metrics_path
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# 全流程共用的 tracer；runner 依設定開關
+tracer = Tracer(enabled=TRACE_ENABLED)
+
+
+def span(name: str, **attrs):
+    """在共用 tracer 上開一個 span"""
+    return tracer.span(name, **attrs)
+
+
+def incr(name: str, value: float = 1, **labels) -> None:
+    """共用 tracer 的 counter 加值"""
+    tracer.incr(name, value, **labels)
@@ -0,0 +1,316 @@
+"""
+watch.py
+--------
+常駐（watch）模式：定期探測 DownloadSeason 是否公布了新季別，只處理新檔案。
+
+每一輪 watch_once():
+    1) 已知季別 = config.SEASONS ∪ 狀態檔中探測到的季別，
+       從最新的已知季別往後探測（fetcher.probe_new_seasons），最多 max_ahead 季
+    2) 產生所有已知季別的任務，排除狀態檔中已處理過的檔案
+    3) 只下載 / 解析 / 篩選這些新檔案
+    4) 增量更新輸出：
+         - filter.csv 附加新列
+         - count.csv 由累計總和重算
+         - quantile.csv / histogram.csv 由累計草圖（sketch）合併後重寫
+         - ES 只寫入新列
+    5) 更新狀態檔（config.WATCH_STATE_PATH）
+
+累計統計是在狀態的副本上更新，與已處理檔案清單一起寫入狀態檔才算完成：
+    - 狀態檔記錄 filter.csv 已確認的位元組數，下一輪附加前先截回這個長度，
+      中途被中斷的那一輪重跑時不會留下重複的列
+    - ES 文件以 df_name + 序號作為 _id，重寫只會覆蓋同一份文件
+    - 單輪失敗後從狀態檔重新載入，不沿用記憶體中可能已改動的統計
+
+成本與新資料量成正比：處理過的檔案不會再下載、解析或寫入 ES；
+下載失敗（例如新季別部分縣市尚未公布）的檔案下一輪會再試。
+解析失敗（例如 schema drift）的檔案會刪掉本地檔案、下一輪重新下載再試，
+最多 MAX_PARSE_ATTEMPTS 次；之後 REQUIRED_FIELDS 改變時會再重新排入。
+
+執行：
+    python -m rec.watch                  # 每 WATCH_INTERVAL_SEC 秒一輪
+    python -m rec.watch --once           # 只跑一輪
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from . import config, parser_cleaner, tracing
+from .atomic import atomic_write
+from .combiner import COUNT_CSV, FILTER_CSV, export_sketches, update_sketches
+from .fetcher import download_tasks, probe_new_seasons
+from .manifest import generate_tasks, next_season, season_key
+from .memory import FrameSpiller, MemoryTracker
+from .runner import filter_parsed, parse_paths, push_es
+from .schema import SchemaRegistry, fingerprint_fields
+from .sketch import LogHistogram
+
+DEFAULT_MAX_AHEAD = 4
+# 解析失敗的檔案最多嘗試幾次（必要欄位改變後重新計算）
+MAX_PARSE_ATTEMPTS = 5
+# 累計總和的欄位（用來重算 count.csv）
+SUM_FIELDS = ("交易筆棟數", "總價元", "車位總價元")
+
+
+class WatchState:
+    """已處理檔案、探測到的季別與累計統計；存成 JSON"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.seasons: List[str] = []
+        # df_name -> {"season", "file_name", "status", "filtered"}
+        #            解析失敗的另有 {"attempts", "fields"}（嘗試次數、當時必要欄位的指紋）
+        self.files: Dict[str, Dict] = {}
+        self.count = 0
+        self.sums: Dict[str, float] = {field: 0.0 for field in SUM_FIELDS}
+        self.sketches: Dict[str, LogHistogram] = {}
+        # filter.csv 已確認（與 files 一起存檔）的位元組數；None 表示舊版狀態檔沒有記錄
+        self.filter_bytes: Optional[int] = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def copy(self) -> "WatchState":
+        """獨立的副本；本輪的更新都在副本上進行，存檔成功後才套回原本的狀態"""
+        other = WatchState()
+        other.path = self.path
+        other.apply(copy.deepcopy(self.to_data()))
+        return other
+
+    def add(self, filtered: pd.DataFrame) -> None:
+        """把新篩選出的資料加進累計統計"""
+        if filtered.empty:
+            return
+        self.count += len(filtered)
+        for field in SUM_FIELDS:
+            self.sums[field] += float(filtered[field].sum())
+        self.sketches = update_sketches(filtered, self.sketches or None)
+
+    def counts_frame(self) -> pd.DataFrame:
+        """與 combiner.aggregate_counts 相同欄位的統計（平均由累計總和計算）"""
+        n = self.count
+        return pd.DataFrame([{
+            "總件數": int(n),
+            "總車位數": int(self.sums["交易筆棟數"]),
+            "平均總價元": self.sums["總價元"] / n if n else 0,
+            "平均車位總價元": self.sums["車位總價元"] / n if n else 0,
+        }])
+
+    def to_data(self) -> Dict:
+        return {
+            "seasons": self.seasons,
+            "files": self.files,
+            "count": self.count,
+            "sums": self.sums,
+            "sketches": {field: sk.to_dict() for field, sk in self.sketches.items()},
+            "filter_bytes": self.filter_bytes,
+        }
+
+    def apply(self, data: Dict) -> None:
+        self.seasons = data["seasons"]
+        self.files = data["files"]
+        self.count = data["count"]
+        self.sums = data["sums"]
+        self.sketches = {field: LogHistogram.from_dict(d) for field, d in data["sketches"].items()}
+        self.filter_bytes = data.get("filter_bytes")
+
+    def load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.apply(json.load(f))
+
+    def save(self) -> Optional[str]:
+        if not self.path:
+            return None
+        # 避免中斷時留下寫一半的狀態檔
+        with atomic_write(self.path) as f:
+            json.dump(self.to_data(), f, ensure_ascii=False)
+        return self.path
+
+
+def export_incremental(filtered: pd.DataFrame, state: WatchState, out_dir: str = config.OUTPUT_DIR) -> None:
+    """
+    增量輸出：filter.csv 先截回 state.filter_bytes（上次確認的長度）再附加新列
+    （尚未寫過或檔案不存在時重寫），count.csv / quantile.csv / histogram.csv 由累計狀態重寫。
+    state 應為本輪的副本（WatchState.copy()），會更新其累計統計與 filter_bytes。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    filter_path = os.path.join(out_dir, FILTER_CSV)
+    count_path = os.path.join(out_dir, COUNT_CSV)
+
+    if len(filtered.columns):
+        committed = state.filter_bytes
+        if committed and os.path.exists(filter_path):
+            size = os.path.getsize(filter_path)
+            if size > committed:
+                # 上一輪寫了 filter.csv 但沒有存檔就中斷，捨棄那些未確認的列
+                print(f"  [WARN] filter.csv 有 {size - committed} 位元組未確認，先截斷")
+                with open(filter_path, "r+b") as f:
+                    f.truncate(committed)
+            elif size < committed:
+                print(f"  [WARN] filter.csv 比狀態檔記錄的短（{size} < {committed}），直接附加")
+            filtered.to_csv(filter_path, mode="a", header=False, index=False, encoding="utf-8")
+        elif committed is None and os.path.exists(filter_path):
+            # 舊版狀態檔沒有記錄長度，沿用直接附加
+            filtered.to_csv(filter_path, mode="a", header=False, index=False, encoding="utf-8")
+        else:
+            filtered.to_csv(filter_path, index=False, encoding="utf-8-sig")
+        state.filter_bytes = os.path.getsize(filter_path)
+    state.add(filtered)
+
+    state.counts_frame().to_csv(count_path, index=False, encoding="utf-8-sig")
+    if state.sketches:
+        export_sketches(state.sketches, out_dir=out_dir)
+    print(f"  filter.csv 新增 {len(filtered)} 筆，累計 {state.count} 筆")
+
+
+def _needs_processing(entry: Optional[Dict], fields_fp: str) -> bool:
+    """尚未處理、或解析失敗但還沒到重試上限（必要欄位改變後重新計算）的檔案"""
+    if entry is None:
+        return True
+    if entry["status"] == "ok":
+        return False
+    return entry.get("fields") != fields_fp or entry.get("attempts", 0) < MAX_PARSE_ATTEMPTS
+
+
+async def watch_once(state: WatchState, all_cities: bool = False,
+                     max_ahead: int = DEFAULT_MAX_AHEAD,
+                     memory_budget_mb: Optional[float] = None) -> List[str]:
+    """
+    執行一輪：探測新季別並處理尚未處理的檔案。
+    回傳本輪成功處理的 df_name 清單。
+    所有更新先做在 state 的副本上，狀態檔存檔成功後才套回 state；
+    中途失敗時 state 維持原狀。
+    """
+    config.ensure_directories()
+    new_state = state.copy()
+
+    # 1) 探測新季別
+    known = sorted(set(config.SEASONS) | set(new_state.seasons), key=season_key)
+    ahead = []
+    season = known[-1]
+    for _ in range(max_ahead):
+        season = next_season(season)
+        ahead.append(season)
+    probe_file = generate_tasks(seasons=known[-1:], all_cities=all_cities)[0]["file_name"]
+    with tracing.span("probe_seasons", after=known[-1]) as sp:
+        new_seasons = await probe_new_seasons(ahead, probe_file)
+        sp.set(published=len(new_seasons))
+    if new_seasons:
+        print(f"[OK] 發現新季別：{new_seasons}")
+    new_state.seasons = sorted(set(new_state.seasons) | set(new_seasons), key=season_key)
+
+    # 2) 只留尚未處理成功、且還可以重試的檔案
+    fields_fp = fingerprint_fields(parser_cleaner.REQUIRED_FIELDS)
+    with tracing.span("manifest", seasons=len(known) + len(new_seasons)) as sp:
+        tasks = [t for t in generate_tasks(seasons=known + new_seasons, all_cities=all_cities)
+                 if _needs_processing(new_state.files.get(t["df_name"]), fields_fp)]
+        sp.set(tasks=len(tasks))
+    if not tasks:
+        new_state.save()
+        state.apply(new_state.to_data())
+        print("沒有新檔案")
+        return []
+
+    # 3) 下載 / 解析 / 篩選（之前解析失敗的檔案重新下載，來源可能已更正）
+    for t in tasks:
+        if t["df_name"] in new_state.files:
+            stale = os.path.join(config.DATA_DIR, t["season"], t["file_name"])
+            if os.path.exists(stale):
+                os.remove(stale)
+    with tracing.span("fetch", tasks=len(tasks)) as sp:
+        paths = await download_tasks(tasks, base_dir=config.DATA_DIR)
+        sp.set(files=len(paths))
+
+    budget_mb = config.MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb
+    tracker = MemoryTracker()
+    spiller = FrameSpiller(budget_bytes=int(budget_mb * 1024 * 1024), spill_dir=config.SPILL_DIR, tracker=tracker)
+    task_map = {(t["season"], t["file_name"]): t for t in tasks}
+    dfname_map = {k: t["df_name"] for k, t in task_map.items()}
+    registry = SchemaRegistry(config.SCHEMA_REGISTRY_PATH)
+    parsed = parse_paths(paths, dfname_map, registry, tracker, spiller)
+    try:
+        filtered = filter_parsed(spiller, tracker)
+    finally:
+        spiller.cleanup()
+
+    # 4) 增量輸出與 ES（ES 失敗時整輪不算完成，下一輪以相同 _id 重寫）
+    with tracing.span("export", rows=len(filtered)):
+        export_incremental(filtered, new_state, out_dir=config.OUTPUT_DIR)
+    push_es(filtered, tracker, raise_errors=True)
+
+    # 5) 記錄已處理的檔案（解析失敗的記錄嘗試次數，下一輪重試直到上限；
+    #    回應是 HTML 錯誤頁的檔案不會存檔，不在 paths 內，下一輪會再下載）
+    per_file = filtered["df_name"].value_counts().to_dict() if len(filtered) else {}
+    for p in paths:
+        t = task_map[(os.path.basename(os.path.dirname(p)), os.path.basename(p))]
+        entry = {
+            "season": t["season"],
+            "file_name": t["file_name"],
+            "status": "ok" if t["df_name"] in parsed else "failed",
+            "filtered": int(per_file.get(t["df_name"], 0)),
+        }
+        if entry["status"] == "failed":
+            previous = new_state.files.get(t["df_name"]) or {}
+            same_fields = previous.get("fields") == fields_fp
+            entry["attempts"] = previous.get("attempts", 0) + 1 if same_fields else 1
+            entry["fields"] = fields_fp
+        new_state.files[t["df_name"]] = entry
+    # 累計統計與已處理檔案一起存檔，存檔成功才算完成
+    new_state.save()
+    state.apply(new_state.to_data())
+    tracker.export(out_dir=config.OUTPUT_DIR)
+    print(f"[OK] 本輪處理 {len(parsed)} 個新檔案")
+    return parsed
+
+
+async def watch(interval_sec: Optional[float] = None, iterations: Optional[int] = None,
+                all_cities: bool = False, max_ahead: int = DEFAULT_MAX_AHEAD) -> None:
+    """
+    常駐執行 watch_once()；iterations 為 None 時不會停止。
+    單輪失敗只印出警告，並從狀態檔重新載入後於下一輪繼續。
+    """
+    interval = config.WATCH_INTERVAL_SEC if interval_sec is None else interval_sec
+    state = WatchState(config.WATCH_STATE_PATH)
+    if tracing.tracer.enabled:
+        # trace.jsonl 每輪附加；啟動時先清掉上次執行留下的內容
+        config.ensure_directories()
+        open(os.path.join(config.OUTPUT_DIR, tracing.TRACE_JSONL), "w", encoding="utf-8").close()
+    n = 0
+    while iterations is None or n < iterations:
+        try:
+            with tracing.span("watch_iteration", iteration=n):
+                await watch_once(state, all_cities=all_cities, max_ahead=max_ahead)
+        except Exception as e:
+            print(f"[WARN] watch 本輪失敗：{e}")
+            state = WatchState(config.WATCH_STATE_PATH)
+        if tracing.tracer.enabled:
+            # 只附加本輪的 span，並從記憶體清掉
+            tracing.tracer.export(out_dir=config.OUTPUT_DIR, append=True)
+        n += 1
+        if iterations is None or n < iterations:
+            await asyncio.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m rec.watch", description="定期處理新公布的季別")
+    parser.add_argument("--interval", type=float, default=None, help="每輪間隔秒數（預設 WATCH_INTERVAL_SEC）")
+    parser.add_argument("--once", action="store_true", help="只執行一輪")
+    parser.add_argument("--all-cities", action="store_true", help="每種交易類型都涵蓋所有縣市")
+    parser.add_argument("--max-ahead", type=int, default=DEFAULT_MAX_AHEAD, help="最多往後探測幾個季別")
+    parser.add_argument("--trace", action="store_true", default=None, help="輸出 trace.jsonl 與 metrics.prom")
+    args = parser.parse_args(argv)
+
+    if args.trace is not None:
+        tracing.tracer.enabled = args.trace
+    asyncio.run(watch(interval_sec=args.interval, iterations=1 if args.once else None,
+                      all_cities=args.all_cities, max_ahead=args.max_ahead))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""測試共用的假 MOI CSV（兩列標題：中文 / 英文）"""
+import os
+
+MOI_ZH = ["鄉鎮市區", "主要用途", "建物型態", "總樓層數", "總價元", "車位總價元", "交易筆棟數"]
+MOI_EN = ["district", "main use", "building state", "total floor number", "total price NTD",
+          "the berth total price NTD", "transaction pen number"]
+
+def moi_csv(rows, zh=MOI_ZH, en=MOI_EN) -> str:
+    """MOI CSV 內容；rows 為以逗號串好的資料列，欄位順序與 zh / en 相同"""
+    lines = [",".join(zh), ",".join(en)] + list(rows)
+    return "\n".join(lines) + "\n"
+
+def write_moi_csv(path, rows, zh=MOI_ZH, en=MOI_EN) -> str:
+    """寫出 MOI CSV（自動建立資料夾），回傳路徑字串"""
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(moi_csv(rows, zh, en))
+    return str(path)
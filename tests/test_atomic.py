@@ -0,0 +1,31 @@
+import pytest
+from rec.atomic import atomic_write
+
+def test_atomic_write_replaces_target(tmp_path):
+    path = tmp_path / "sub" / "state.json"
+    with atomic_write(str(path)) as f:
+        f.write("新內容")
+
+    assert path.read_text(encoding="utf-8") == "新內容"
+    assert [p.name for p in path.parent.iterdir()] == ["state.json"]
+
+def test_atomic_write_keeps_target_on_error(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("old", encoding="utf-8")
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as f:
+            f.write("half")
+            raise RuntimeError("killed")
+
+    assert path.read_text(encoding="utf-8") == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
+
+def test_atomic_write_uses_distinct_temp_files(tmp_path):
+    path = str(tmp_path / "data.bin")
+    with atomic_write(path, "wb") as a, atomic_write(path, "wb") as b:
+        assert a.name != b.name
+        a.write(b"first")
+        b.write(b"second")
+
+    assert open(path, "rb").read() == b"first"
@@ -1,7 +1,8 @@
 import pytest
 import re
 from rec import config
-from rec.manifest import (season_to_year_quarter, build_file_name,build_df_name,generate_tasks)
+from rec.manifest import (season_to_year_quarter, build_file_name,build_df_name,generate_tasks,
+                          parse_shard, shard_tasks, next_season)
 
 def test_season_to_year_quarter():
     assert season_to_year_quarter("106S1") == ("106", 1)
@@ -78,3 +79,47 @@ def test_generate_tasks_invalid_trade_types_raises_value_error():
             include_trade_types=["買賣"],
             include_cities=["台北市"]  
         )
+
+def test_generate_tasks_all_cities():
+    tasks = generate_tasks(seasons=["106S1"], all_cities=True)
+
+    assert len(tasks) == len(config.ALL_CITIES) * len(config.TRADE_TYPE)
+    t = next(x for x in tasks if x["city_name"] == "臺南市" and x["trade_type_name"] == "預售屋買賣")
+    assert t["df_name"] == "106_1_D_B"
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+    assert parse_shard("4/4") == (4, 4)
+
+    for bad in ["0/4", "5/4", "1/0", "a/b", "3"]:
+        with pytest.raises(ValueError, match="Invalid shard"):
+            parse_shard(bad)
+
+def test_shard_tasks_partition_is_stable_and_complete():
+    tasks = generate_tasks(seasons=["103S1", "103S2", "103S3"], all_cities=True)
+    shards = [shard_tasks(tasks, i, 4) for i in range(1, 5)]
+
+    names = [t["df_name"] for s in shards for t in s]
+    assert sorted(names) == sorted(t["df_name"] for t in tasks)
+    assert len(set(names)) == len(names)
+    # 每個分片維持原本的任務順序，重算結果相同
+    for i, s in enumerate(shards, start=1):
+        assert s == [t for t in tasks if t in s]
+        assert s == shard_tasks(tasks, i, 4)
+    assert max(map(len, shards)) - min(map(len, shards)) <= 1
+
+def test_shard_tasks_balances_by_weight():
+    tasks = generate_tasks(seasons=["103S1", "103S2"])
+    weights = {"A_lvr_land_A.csv": 100.0, "F_lvr_land_A.csv": 60.0, "E_lvr_land_A.csv": 40.0,
+               "H_lvr_land_B.csv": 10.0, "B_lvr_land_B.csv": 10.0}
+    loads = [sum(weights[t["file_name"]] for t in shard_tasks(tasks, i, 2, weights)) for i in (1, 2)]
+
+    assert loads == [220.0, 220.0]
+
+def test_next_season():
+    assert next_season("108S2") == "108S3"
+    assert next_season("108S4") == "109S1"
+    assert season_to_year_quarter(next_season("113S4")) == ("114", 1)
+
+    with pytest.raises(ValueError, match="Invalid year: 99"):
+        season_to_year_quarter("99S1")
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import pandas as pd
+import pytest
+from rec import config, runner
+from rec.memory import MemoryTracker, FrameSpiller, frame_bytes, peak_rss_bytes
+from conftest import write_moi_csv
+
+def _frame(n, start=0):
+    return pd.DataFrame({"df_name": ["x"] * n, "總價元": [float(i) for i in range(start, start + n)]})
+
+def test_tracker_records_rows_and_deep_bytes(tmp_path):
+    tracker = MemoryTracker()
+    df = _frame(10)
+    row = tracker.record("parse", df, name="106_1_A_A")
+
+    assert row["列數"] == 10
+    assert row["DataFrame位元組"] == frame_bytes(df) > 0
+    assert 0 < row["峰值RSS位元組"] <= peak_rss_bytes()
+
+    path = tracker.export(out_dir=str(tmp_path))
+    out = pd.read_csv(path, encoding="utf-8-sig")
+    assert list(out["階段"]) == ["parse"]
+    assert list(out["對象"]) == ["106_1_A_A"]
+
+def test_spiller_without_budget_keeps_frames_in_memory(tmp_path):
+    spiller = FrameSpiller(budget_bytes=0, spill_dir=str(tmp_path / "spill"))
+    for i in range(3):
+        spiller.add(_frame(100, start=i * 100))
+
+    assert spiller.spilled == []
+    assert len(spiller.buffer) == 3
+
+def test_spiller_over_budget_spills_and_preserves_order(tmp_path):
+    spill_dir = tmp_path / "spill"
+    budget = frame_bytes(_frame(100)) + 1
+    spiller = FrameSpiller(budget_bytes=budget, spill_dir=str(spill_dir))
+    frames = [_frame(100, start=i * 100) for i in range(5)]
+    for df in frames:
+        spiller.add(df)
+
+    assert len(spiller.spilled) == 2
+    assert all(os.path.exists(p) for p in spiller.spilled)
+
+    result = pd.concat(list(spiller.iter_chunks()), ignore_index=True)
+    expected = pd.concat(frames, ignore_index=True)
+    pd.testing.assert_frame_equal(result, expected)
+
+    spiller.cleanup()
+    assert list(spill_dir.iterdir()) == []
+
+def test_concurrent_spillers_do_not_share_files(tmp_path):
+    spill_dir = tmp_path / "spill"
+    budget = frame_bytes(_frame(100)) + 1
+    a = FrameSpiller(budget_bytes=budget, spill_dir=str(spill_dir))
+    b = FrameSpiller(budget_bytes=budget, spill_dir=str(spill_dir))
+    frames_a = [_frame(100, start=0) for _ in range(2)]
+    frames_b = [_frame(100, start=1000) for _ in range(2)]
+    for fa, fb in zip(frames_a, frames_b):
+        a.add(fa)
+        b.add(fb)
+
+    assert a.private_dir != b.private_dir
+    assert not set(a.spilled) & set(b.spilled)
+    a.cleanup()
+    assert all(os.path.exists(p) for p in b.spilled)
+    pd.testing.assert_frame_equal(pd.concat(list(b.iter_chunks()), ignore_index=True),
+                                  pd.concat(frames_b, ignore_index=True))
+    b.cleanup()
+
+@pytest.mark.parametrize("budget_mb", [0, 0.000001])
+def test_run_outputs_match_with_and_without_spill(tmp_path, monkeypatch, budget_mb):
+    data_dir = tmp_path / "data"
+    paths = []
+    for season in ["106S1", "106S2", "106S3"]:
+        p = data_dir / season / "A_lvr_land_A.csv"
+        write_moi_csv(p, [
+            "大安區,住家用,住宅大樓(11層含以上有電梯),十五層,25000000,2000000,土地1建物1車位1",
+            "信義區,住家用,住宅大樓(11層含以上有電梯),十層,18000000,0,土地1建物1車位0",
+            "中山區,商業用,辦公商業大樓,二十層,50000000,0,土地1建物1車位0",
+        ])
+        paths.append(str(p))
+
+    async def fake_download_tasks(tasks, base_dir=None):
+        return paths
+
+    out_dir = tmp_path / f"output_{budget_mb}"
+    monkeypatch.setattr(runner, "download_tasks", fake_download_tasks)
+    monkeypatch.setattr(config, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(out_dir))
+    monkeypatch.setattr(config, "SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setattr(config, "SCHEMA_REGISTRY_PATH", str(tmp_path / "schema_registry.json"))
+    monkeypatch.setenv("ES_HOST", "")
+
+    asyncio.run(runner.run(all_seasons=False, memory_budget_mb=budget_mb))
+
+    filtered = pd.read_csv(out_dir / "filter.csv", encoding="utf-8-sig")
+    assert len(filtered) == 3
+    assert set(filtered["總價元"]) == {25000000}
+
+    memory = pd.read_csv(out_dir / "memory.csv", encoding="utf-8-sig")
+    assert (memory["階段"] == "parse").sum() == 3
+    assert ("spill" in set(memory["階段"])) == (budget_mb > 0)
+    assert not (tmp_path / "spill").exists() or list((tmp_path / "spill").iterdir()) == []
@@ -0,0 +1,105 @@
+import pytest
+from rec.parser_cleaner import read_csv_file, REQUIRED_FIELDS
+from rec.schema import SchemaRegistry, SchemaDriftError, compile_plan, fingerprint_header
+from conftest import MOI_ZH as ZH, MOI_EN as EN, write_moi_csv
+ROWS = [
+    '大安區,住家用,住宅大樓(11層含以上有電梯),十五層,"25,000,000",2000000,土地1建物1車位1',
+    '信義區,住家用,華廈(10層含以下有電梯),七層,,,',
+]
+
+def _write_csv(path, zh=ZH, en=EN, rows=ROWS):
+    return write_moi_csv(path, rows, zh, en)
+
+def test_read_csv_file_with_new_layout_flags_drift_once(tmp_path):
+    registry = SchemaRegistry()
+    df = read_csv_file(_write_csv(tmp_path / "a.csv"), df_name="106_1_A_A", registry=registry)
+
+    assert list(df.columns) == ["df_name"] + list(REQUIRED_FIELDS) + ["總樓層數_數值"]
+    assert df["總價元"].tolist() == [25000000.0, 0.0]
+    assert df["車位總價元"].tolist() == [2000000.0, 0.0]
+    assert df["總樓層數_數值"].tolist() == [15, 7]
+    assert df["主要用途"].tolist() == ["住家用", "住家用"]
+    assert len(registry.drift) == 1 and registry.hits == 0
+
+    read_csv_file(_write_csv(tmp_path / "b.csv"), df_name="106_1_F_A", registry=registry)
+    assert len(registry.drift) == 1
+    assert registry.hits == 1
+
+def test_duplicated_english_header_uses_first_column():
+    zh = ["總價元", "總價元備註"]
+    en = ["total price NTD", "total price NTD"]
+    plan = compile_plan(zh, en, {"總價元": "float"})
+
+    assert plan["columns"]["總價元"]["position"] == 0
+    assert plan["missing"] == []
+
+def test_missing_required_field_raises_schema_drift(tmp_path):
+    registry = SchemaRegistry()
+    path = _write_csv(tmp_path / "bad.csv", zh=ZH[:-1], en=EN[:-1],
+                      rows=[r.rsplit(",", 1)[0] for r in ROWS])
+
+    with pytest.raises(SchemaDriftError, match="交易筆棟數"):
+        read_csv_file(path, df_name="x", registry=registry)
+    assert registry.plans == {}
+    assert registry.drift[0]["missing"] == ["交易筆棟數"]
+
+def test_registry_roundtrip_knows_saved_layouts(tmp_path):
+    registry_path = str(tmp_path / "schema_registry.json")
+    registry = SchemaRegistry(registry_path)
+    read_csv_file(_write_csv(tmp_path / "a.csv"), df_name="x", registry=registry)
+    registry.save()
+
+    reloaded = SchemaRegistry(registry_path)
+    assert fingerprint_header(ZH, EN) in reloaded.plans
+    read_csv_file(_write_csv(tmp_path / "b.csv"), df_name="x", registry=reloaded)
+    assert reloaded.drift == []
+    assert reloaded.hits == 1
+
+def test_header_only_file_returns_empty_frame(tmp_path):
+    df = read_csv_file(_write_csv(tmp_path / "empty.csv", rows=[]), df_name="x", registry=SchemaRegistry())
+
+    assert df.empty
+    assert "總樓層數_數值" in df.columns
+
+def test_corrupt_registry_file_is_treated_as_empty(tmp_path):
+    registry_path = tmp_path / "schema_registry.json"
+    registry_path.write_text('{"abc": {"fingerprint": ', encoding="utf-8")
+
+    registry = SchemaRegistry(str(registry_path))
+    assert registry.plans == {}
+
+    read_csv_file(_write_csv(tmp_path / "a.csv"), df_name="x", registry=registry)
+    registry.save()
+    assert fingerprint_header(ZH, EN) in SchemaRegistry(str(registry_path)).plans
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+def test_cached_plan_is_recompiled_when_required_fields_grow(tmp_path):
+    registry_path = str(tmp_path / "schema_registry.json")
+    registry = SchemaRegistry(registry_path)
+    read_csv_file(_write_csv(tmp_path / "a.csv"), df_name="x", registry=registry)
+    registry.save()
+
+    # 新增必要欄位後，已登錄的格式必須重新編譯，而不是在讀欄位時 KeyError
+    fields = dict(REQUIRED_FIELDS, 鄉鎮市區="str")
+    reloaded = SchemaRegistry(registry_path)
+    plan = reloaded.get_plan(ZH, EN, fields, source="b.csv")
+    assert plan["columns"]["鄉鎮市區"]["position"] == 0
+    assert reloaded.hits == 0 and len(reloaded.drift) == 1
+    assert reloaded.get_plan(ZH, EN, fields) is plan
+    assert reloaded.hits == 1
+
+    # 新欄位不在檔案中時回報 schema drift
+    with pytest.raises(SchemaDriftError, match="單價元平方公尺"):
+        reloaded.get_plan(ZH, EN, dict(REQUIRED_FIELDS, 單價元平方公尺="float"), source="c.csv")
+
+def test_read_csv_file_after_required_field_added(tmp_path, monkeypatch):
+    from rec import parser_cleaner
+
+    registry_path = str(tmp_path / "schema_registry.json")
+    registry = SchemaRegistry(registry_path)
+    read_csv_file(_write_csv(tmp_path / "a.csv"), df_name="x", registry=registry)
+    registry.save()
+
+    monkeypatch.setattr(parser_cleaner, "REQUIRED_FIELDS", dict(REQUIRED_FIELDS, 鄉鎮市區="str"))
+    df = read_csv_file(_write_csv(tmp_path / "b.csv"), df_name="x", registry=SchemaRegistry(registry_path))
+    assert df["鄉鎮市區"].tolist() == ["大安區", "信義區"]
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+import pandas as pd
+import pytest
+from rec import config, runner
+from rec.manifest import generate_tasks
+from rec.shard import reduce_partials, shard_dir, SIZES_JSON, PARTIAL_JSON
+from conftest import write_moi_csv
+
+OUTPUTS = ["filter.csv", "count.csv", "quantile.csv", "histogram.csv"]
+FLOORS = ["十三層", "十五層", "二十層", "十二層"]
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """每個任務一個假的 MOI CSV；download_tasks 依任務順序回傳存在的檔案"""
+    data_dir = tmp_path / "data"
+    for n, t in enumerate(generate_tasks(seasons=config.SEASONS[:1])):
+        rows = [f"大安區,住家用,住宅大樓(11層含以上有電梯),{FLOORS[k % 4]},{(n + 1) * 1000003 + k * 7919},{k % 3 * 150000},土地1建物1車位1"
+                for k in range(20 + n)]
+        rows.append("中山區,商業用,辦公商業大樓,二十層,99999999,0,土地1建物1車位0")
+        write_moi_csv(data_dir / t["season"] / t["file_name"], rows)
+
+    async def fake_download_tasks(tasks, base_dir=None):
+        paths = [os.path.join(base_dir, t["season"], t["file_name"]) for t in tasks]
+        return [p for p in paths if os.path.exists(p)]
+
+    monkeypatch.setattr(runner, "download_tasks", fake_download_tasks)
+    monkeypatch.setattr(config, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(config, "SHARD_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(config, "SCHEMA_REGISTRY_PATH", str(tmp_path / "schema_registry.json"))
+    monkeypatch.setenv("ES_HOST", "")
+    return tmp_path
+
+def _read_outputs(out_dir):
+    return {name: (out_dir / name).read_bytes() for name in OUTPUTS}
+
+@pytest.mark.parametrize("count", [1, 2, 3, 7])
+def test_sharded_run_matches_single_node(pipeline, monkeypatch, count):
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(pipeline / "single"))
+    asyncio.run(runner.run(all_seasons=False))
+    single = _read_outputs(pipeline / "single")
+    assert len(pd.read_csv(pipeline / "single" / "filter.csv", encoding="utf-8-sig")) > 0
+
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(pipeline / "sharded"))
+    for i in range(1, count + 1):
+        asyncio.run(runner.run(all_seasons=False, shard=(i, count)))
+    runner.reduce_shards(count)
+
+    assert _read_outputs(pipeline / "sharded") == single
+    assert (pipeline / "shards" / SIZES_JSON).exists()
+
+def test_reduce_with_missing_shard_raises_value_error(pipeline, monkeypatch):
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(pipeline / "sharded"))
+    asyncio.run(runner.run(all_seasons=False, shard=(1, 2)))
+
+    assert os.path.exists(shard_dir(1, 2, config.SHARD_DIR))
+    with pytest.raises(ValueError, match=r"Missing shards: \[2\] of 2"):
+        reduce_partials(2, base_dir=config.SHARD_DIR)
+
+def test_reduce_rejects_shards_split_with_different_weights(pipeline, monkeypatch):
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(pipeline / "sharded"))
+    asyncio.run(runner.run(all_seasons=False, shard=(1, 2)))
+
+    # 第二個 worker 看到較新的 sizes.json，切出來的分片與第一個不一致
+    os.makedirs(config.SHARD_DIR, exist_ok=True)
+    with open(os.path.join(config.SHARD_DIR, SIZES_JSON), "w", encoding="utf-8") as f:
+        json.dump({"A_lvr_land_A.csv": 100.0, "F_lvr_land_A.csv": 1.0}, f)
+    asyncio.run(runner.run(all_seasons=False, shard=(2, 2)))
+
+    with pytest.raises(ValueError, match="different weights"):
+        reduce_partials(2, base_dir=config.SHARD_DIR)
+
+@pytest.mark.parametrize("tamper, message", [
+    (lambda order, other: order.popitem(), "cover 4 of 5 tasks"),
+    (lambda order, other: order.update(other), "more than one shard"),
+])
+def test_reduce_checks_every_task_is_covered_exactly_once(pipeline, monkeypatch, tamper, message):
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(pipeline / "sharded"))
+    for i in (1, 2):
+        asyncio.run(runner.run(all_seasons=False, shard=(i, 2)))
+
+    paths = [os.path.join(shard_dir(i, 2, config.SHARD_DIR), PARTIAL_JSON) for i in (1, 2)]
+    partials = [json.load(open(p, encoding="utf-8")) for p in paths]
+    tamper(partials[1]["order"], partials[0]["order"])
+    with open(paths[1], "w", encoding="utf-8") as f:
+        json.dump(partials[1], f, ensure_ascii=False)
+
+    with pytest.raises(ValueError, match=message):
+        reduce_partials(2, base_dir=config.SHARD_DIR)
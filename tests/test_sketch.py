@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rec.sketch import LogHistogram
+from rec.combiner import update_sketches, merge_sketches, export_sketches
+
+QS = [0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 1.0]
+
+def _assert_within_bound(sk, values):
+    for q in QS:
+        exact = np.quantile(values, q, method="lower")
+        est = sk.quantile(q)
+        if exact == 0:
+            assert est == 0
+        else:
+            # 相對誤差 <= alpha（多留一點浮點誤差空間）
+            assert abs(est - exact) <= sk.alpha * exact * (1 + 1e-9)
+
+def test_quantile_error_bound_against_numpy():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(mean=16, sigma=0.8, size=20000)
+    sk = LogHistogram(alpha=0.01)
+    for chunk in np.array_split(values, 7):
+        sk.update(chunk)
+
+    assert sk.count == len(values)
+    _assert_within_bound(sk, values)
+
+def test_zero_values_and_nan():
+    values = np.array([0, 0, 0, 0, 500000, 800000, np.nan, 1200000], dtype=float)
+    sk = LogHistogram().update(values)
+
+    assert sk.count == 7
+    assert sk.zero_count == 4
+    assert sk.quantile(0.5) == 0
+    _assert_within_bound(sk, values[~np.isnan(values)])
+
+def test_merge_equals_single_pass():
+    rng = np.random.default_rng(1)
+    a = rng.lognormal(15, 1.0, 3000)
+    b = np.concatenate([np.zeros(500), rng.lognormal(13, 0.5, 2000)])
+
+    single = LogHistogram().update(np.concatenate([a, b]))
+    merged = LogHistogram().update(a).merge(LogHistogram().update(b))
+
+    assert merged.bins == single.bins
+    assert merged.zero_count == single.zero_count
+    assert merged.count == single.count
+    assert merged.min == single.min and merged.max == single.max
+    assert merged.quantile(0.9) == single.quantile(0.9)
+
+def test_merge_different_alpha_raises_value_error():
+    with pytest.raises(ValueError, match="different alpha"):
+        LogHistogram(alpha=0.01).merge(LogHistogram(alpha=0.02))
+
+def test_to_dict_roundtrip():
+    sk = LogHistogram().update([0, 1.5, 100, 1e7])
+    back = LogHistogram.from_dict(sk.to_dict())
+
+    assert back.bins == sk.bins
+    assert back.quantile(0.5) == sk.quantile(0.5)
+
+def test_buckets_cover_all_values():
+    values = [0, 0, 3, 30, 300, 3000]
+    sk = LogHistogram().update(values)
+    buckets = sk.buckets()
+
+    assert sum(n for _, _, n in buckets) == len(values)
+    assert buckets[0] == (0.0, 0.0, 2)
+    for lower, upper, _ in buckets[1:]:
+        assert lower < upper
+
+def test_export_sketches_next_to_count_csv(tmp_path):
+    df1 = pd.DataFrame({"總價元": [1e7, 2e7], "車位總價元": [0.0, 1e6]})
+    df2 = pd.DataFrame({"總價元": [3e7], "車位總價元": [2e6]})
+    sketches = merge_sketches([update_sketches(df1), update_sketches(df2)])
+
+    quantile_path, histogram_path = export_sketches(sketches, out_dir=str(tmp_path))
+
+    quantiles = pd.read_csv(quantile_path, encoding="utf-8-sig")
+    assert list(quantiles["欄位"]) == ["總價元", "車位總價元"]
+    assert list(quantiles["件數"]) == [3, 3]
+    assert quantiles.loc[0, "中位數"] == pytest.approx(2e7, rel=0.01)
+
+    histogram = pd.read_csv(histogram_path, encoding="utf-8-sig")
+    assert histogram.groupby("欄位")["件數"].sum().to_dict() == {"總價元": 3, "車位總價元": 3}
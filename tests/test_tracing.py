@@ -0,0 +1,114 @@
+import asyncio
+import json
+import pytest
+from rec import config, runner, tracing
+from rec.tracing import Tracer
+from conftest import write_moi_csv
+
+def test_disabled_tracer_records_nothing():
+    tr = Tracer(enabled=False)
+    with tr.span("parse", file="a.csv") as sp:
+        sp.set(rows=10)
+    tr.incr("rows_parsed", 10)
+
+    assert tr.spans == []
+    assert tr.counters == {}
+
+def test_spans_nest_and_record_errors():
+    tr = Tracer(enabled=True)
+    with tr.span("run") as outer:
+        with tr.span("parse", file="a.csv") as inner:
+            inner.set(rows=3)
+        with pytest.raises(ValueError):
+            with tr.span("filter"):
+                raise ValueError("boom")
+
+    parse, filt, run = tr.spans
+    assert parse.parent_id == outer.span_id
+    assert parse.attrs == {"file": "a.csv", "rows": 3}
+    assert filt.status == "error" and "boom" in filt.attrs["error"]
+    assert run.parent_id is None
+    assert run.duration >= parse.duration
+
+def test_async_tasks_inherit_parent_span():
+    tr = Tracer(enabled=True)
+
+    async def download(i):
+        with tr.span("download", i=i):
+            await asyncio.sleep(0)
+
+    async def main():
+        with tr.span("fetch") as sp:
+            await asyncio.gather(*(download(i) for i in range(3)))
+        return sp.span_id
+
+    fetch_id = asyncio.run(main())
+    downloads = [s for s in tr.spans if s.name == "download"]
+    assert len(downloads) == 3
+    assert all(s.parent_id == fetch_id for s in downloads)
+
+def test_export_jsonl_and_prometheus(tmp_path):
+    tr = Tracer(enabled=True)
+    for _ in range(2):
+        with tr.span("download", url="u"):
+            pass
+    tr.incr("bytes_downloaded", 1024)
+    tr.incr("es_docs", 5, index='land"filter')
+
+    trace_path, metrics_path = tr.export(out_dir=str(tmp_path))
+
+    lines = [json.loads(l) for l in open(trace_path, encoding="utf-8")]
+    assert [l["name"] for l in lines] == ["download", "download"]
+
+    text = open(metrics_path, encoding="utf-8").read()
+    assert "# TYPE rec_bytes_downloaded_total counter\nrec_bytes_downloaded_total 1024\n" in text
+    assert 'rec_es_docs_total{index="land\\"filter"} 5' in text
+    assert 'rec_span_duration_seconds_count{span="download"} 2' in text
+    assert 'rec_span_errors_total{span="download"} 0' in text
+
+def test_append_export_drains_spans_and_keeps_totals(tmp_path):
+    tr = Tracer(enabled=True)
+    for round_no in range(3):
+        with tr.span("watch_iteration", iteration=round_no):
+            tr.incr("files_downloaded")
+        tr.export(out_dir=str(tmp_path), append=True)
+        # 每輪匯出後記憶體中不留 span
+        assert tr.spans == []
+
+    lines = [json.loads(l) for l in open(tmp_path / tracing.TRACE_JSONL, encoding="utf-8")]
+    assert [l["attrs"]["iteration"] for l in lines] == [0, 1, 2]
+
+    text = open(tmp_path / tracing.METRICS_PROM, encoding="utf-8").read()
+    assert "rec_files_downloaded_total 3\n" in text
+    assert 'rec_span_duration_seconds_count{span="watch_iteration"} 3' in text
+
+def test_run_traces_every_stage(tmp_path, monkeypatch):
+    csv_path = tmp_path / "data" / "103S1" / "A_lvr_land_A.csv"
+    write_moi_csv(csv_path, ["大安區,住家用,住宅大樓(11層含以上有電梯),十五層,25000000,0,土地1建物1車位0"])
+
+    async def fake_download_tasks(tasks, base_dir=None):
+        return [str(csv_path)]
+
+    out_dir = tmp_path / "output"
+    monkeypatch.setattr(tracing, "tracer", Tracer(enabled=False))
+    monkeypatch.setattr(runner, "download_tasks", fake_download_tasks)
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(out_dir))
+    monkeypatch.setattr(config, "SCHEMA_REGISTRY_PATH", str(tmp_path / "schema_registry.json"))
+    monkeypatch.setenv("ES_HOST", "")
+
+    asyncio.run(runner.run(all_seasons=False, trace=True))
+    # trace=True 只影響該次執行
+    assert tracing.tracer.enabled is False
+
+    names = {json.loads(l)["name"] for l in open(out_dir / "trace.jsonl", encoding="utf-8")}
+    assert {"run", "manifest", "fetch", "parse", "combine", "filter", "aggregate", "export"} <= names
+    assert "rec_rows_parsed_total 1" in (out_dir / "metrics.prom").read_text(encoding="utf-8")
+
+    # 同一行程再執行一次：trace.jsonl 只有這次的 span
+    first = (out_dir / "trace.jsonl").read_text(encoding="utf-8").splitlines()
+    asyncio.run(runner.run(all_seasons=False, trace=True))
+    second = [json.loads(l) for l in open(out_dir / "trace.jsonl", encoding="utf-8")]
+    assert len(second) == len(first)
+    assert [s["name"] for s in second].count("run") == 1
+    assert tracing.tracer.spans == []
@@ -0,0 +1,362 @@
+import asyncio
+from contextlib import contextmanager
+import pandas as pd
+import pytest
+from aiohttp import web
+from rec import config, fetcher
+from rec.manifest import generate_tasks
+from rec.watch import WatchState, watch_once, watch
+from conftest import MOI_EN, MOI_ZH, moi_csv
+
+def _publish(files, season):
+    """在假的 DownloadSeason 上公布一個季別（每個檔案 3 筆，其中 2 筆符合篩選條件）"""
+    for n, t in enumerate(generate_tasks(seasons=[season])):
+        rows = [
+            f"大安區,住家用,住宅大樓(11層含以上有電梯),十五層,{(n + 1) * 1000000},0,土地1建物1車位0",
+            f"大安區,住家用,住宅大樓(11層含以上有電梯),二十層,{(n + 1) * 2000000},500000,土地1建物1車位1",
+            "大安區,住家用,公寓(5樓含以下無電梯),五層,8000000,0,土地1建物1車位0",
+        ]
+        files[(season, t["file_name"])] = moi_csv(rows).encode("utf-8")
+
+async def _start_server(files, hits):
+    async def handler(request):
+        key = (request.query["season"], request.query["fileName"])
+        hits.append(key)
+        if key in files:
+            return web.Response(body=files[key], content_type="text/csv")
+        return web.Response(status=404, text="<html>not published</html>", content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/DownloadSeason", handler)
+    server = web.AppRunner(app)
+    await server.setup()
+    site = web.TCPSite(server, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}/DownloadSeason"
+
+@pytest.fixture
+def watch_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SEASONS", ["108S1"])
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(config, "OUTPUT_DIR", str(tmp_path / "output"))
+    monkeypatch.setattr(config, "SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setattr(config, "SCHEMA_REGISTRY_PATH", str(tmp_path / "schema_registry.json"))
+    monkeypatch.setattr(config, "WATCH_STATE_PATH", str(tmp_path / "watch_state.json"))
+    monkeypatch.setenv("ES_HOST", "")
+    return tmp_path
+
+def test_watch_processes_only_new_seasons(watch_env, monkeypatch):
+    files, hits = {}, []
+    _publish(files, "108S1")
+    out_dir = watch_env / "output"
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            state = WatchState(config.WATCH_STATE_PATH)
+            first = await watch_once(state, max_ahead=2)
+
+            # 新季別公布：只處理 108S2 的檔案
+            _publish(files, "108S2")
+            hits.clear()
+            state = WatchState(config.WATCH_STATE_PATH)
+            second = await watch_once(state, max_ahead=2)
+            second_hits = list(hits)
+
+            hits.clear()
+            third = await watch_once(state, max_ahead=2)
+            return first, second, second_hits, third, list(hits), state
+        finally:
+            await server.cleanup()
+
+    first, second, second_hits, third, third_hits, state = asyncio.run(scenario())
+
+    assert sorted(first) == sorted(t["df_name"] for t in generate_tasks(seasons=["108S1"]))
+    assert sorted(second) == sorted(t["df_name"] for t in generate_tasks(seasons=["108S2"]))
+    assert not any(season == "108S1" for season, _ in second_hits)
+    assert third == []
+    # 第三輪只探測，不下載任何檔案
+    assert {season for season, _ in third_hits} == {"108S3"}
+    assert state.seasons == ["108S2"]
+
+    filtered = pd.read_csv(out_dir / "filter.csv", encoding="utf-8-sig")
+    assert len(filtered) == 20
+    assert filtered["df_name"].str.startswith("108_2_").sum() == 10
+
+    counts = pd.read_csv(out_dir / "count.csv", encoding="utf-8-sig")
+    assert counts.loc[0, "總件數"] == 20
+    assert counts.loc[0, "平均總價元"] == pytest.approx(filtered["總價元"].mean())
+    assert counts.loc[0, "平均車位總價元"] == pytest.approx(filtered["車位總價元"].mean())
+
+    quantiles = pd.read_csv(out_dir / "quantile.csv", encoding="utf-8-sig")
+    assert list(quantiles["件數"]) == [20, 20]
+
+def test_watch_state_roundtrip(tmp_path):
+    path = str(tmp_path / "state.json")
+    state = WatchState(path)
+    state.seasons = ["108S3"]
+    state.files["108_3_A_A"] = {"season": "108S3", "file_name": "A_lvr_land_A.csv", "status": "ok", "filtered": 1}
+    state.add(pd.DataFrame({"df_name": ["108_3_A_A"], "交易筆棟數": [0.0], "總價元": [1e7], "車位總價元": [0.0]}))
+    state.save()
+
+    back = WatchState(path)
+    assert back.seasons == ["108S3"]
+    assert back.files == state.files
+    assert back.counts_frame().equals(state.counts_frame())
+    assert back.sketches["總價元"].count == 1
+
+def test_watch_survives_unreachable_server(watch_env, monkeypatch):
+    monkeypatch.setattr(fetcher, "BASE_URL", "http://127.0.0.1:9/DownloadSeason")
+
+    asyncio.run(watch(interval_sec=0, iterations=2, max_ahead=1))
+
+    state = WatchState(config.WATCH_STATE_PATH)
+    assert state.files == {}
+
+def test_watch_round_failure_does_not_duplicate(watch_env, monkeypatch):
+    """寫完 filter.csv 後中斷（狀態未存檔）：重跑不會有重複列，累計統計也不會重複計算"""
+    from rec import watch as watch_mod
+
+    files, hits = {}, []
+    _publish(files, "108S1")
+    out_dir = watch_env / "output"
+    real_push_es = watch_mod.push_es
+    calls = []
+
+    def flaky_push_es(filtered, tracker, raise_errors=False):
+        calls.append(len(filtered))
+        if len(calls) == 2:
+            raise RuntimeError("ES down")
+        return real_push_es(filtered, tracker, raise_errors=raise_errors)
+
+    monkeypatch.setattr(watch_mod, "push_es", flaky_push_es)
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            state = WatchState(config.WATCH_STATE_PATH)
+            await watch_once(state, max_ahead=1)
+            _publish(files, "108S2")
+            with pytest.raises(RuntimeError):
+                await watch_once(state, max_ahead=1)
+            # 失敗的一輪不改動記憶體中與磁碟上的狀態
+            assert state.count == 10
+            assert WatchState(config.WATCH_STATE_PATH).count == 10
+            assert len(pd.read_csv(out_dir / "filter.csv", encoding="utf-8-sig")) == 20
+            return await watch_once(state, max_ahead=1), state
+        finally:
+            await server.cleanup()
+
+    replayed, state = asyncio.run(scenario())
+
+    assert sorted(replayed) == sorted(t["df_name"] for t in generate_tasks(seasons=["108S2"]))
+    filtered = pd.read_csv(out_dir / "filter.csv", encoding="utf-8-sig")
+    assert len(filtered) == 20
+    assert not filtered.duplicated().any()
+    assert state.count == 20
+    assert WatchState(config.WATCH_STATE_PATH).sketches["總價元"].count == 20
+    counts = pd.read_csv(out_dir / "count.csv", encoding="utf-8-sig")
+    assert counts.loc[0, "總件數"] == 20
+
+def test_watch_reloads_state_after_failed_round(watch_env, monkeypatch):
+    from rec import watch as watch_mod
+
+    files, hits = {}, []
+    _publish(files, "108S1")
+    real_export = watch_mod.export_incremental
+    calls = []
+
+    def failing_export(filtered, state, out_dir):
+        real_export(filtered, state, out_dir)
+        calls.append(state)
+        if len(calls) == 1:
+            raise RuntimeError("disk full")
+
+    monkeypatch.setattr(watch_mod, "export_incremental", failing_export)
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            await watch(interval_sec=0, iterations=2, max_ahead=1)
+        finally:
+            await server.cleanup()
+
+    asyncio.run(scenario())
+
+    state = WatchState(config.WATCH_STATE_PATH)
+    assert state.count == 10
+    assert state.sketches["總價元"].count == 10
+    assert len(pd.read_csv(watch_env / "output" / "filter.csv", encoding="utf-8-sig")) == 10
+
+def test_row_doc_ids_are_deterministic():
+    from rec.sink_es import row_doc_ids
+
+    df = pd.DataFrame({"df_name": ["108_1_A_A", "108_1_A_A", "108_1_B_A"], "總價元": [1, 2, 3]})
+    assert row_doc_ids(df) == ["108_1_A_A_0", "108_1_A_A_1", "108_1_B_A_0"]
+    # 同一檔案的列在其他檔案之後才出現時序號仍連續
+    assert row_doc_ids(df.iloc[[0, 2, 1]]) == ["108_1_A_A_0", "108_1_B_A_0", "108_1_A_A_1"]
+
+def test_watch_retries_file_that_returned_html(watch_env, monkeypatch):
+    """回應 200 但內容是 HTML 錯誤頁的檔案不存檔、不記錄，下一輪重新下載"""
+    files, hits = {}, []
+    _publish(files, "108S1")
+    tasks = generate_tasks(seasons=["108S1"])
+    target = tasks[-1]
+    key = ("108S1", target["file_name"])
+    real_csv = files[key]
+    files[key] = b"\r\n<!DOCTYPE html><html>maintenance</html>"
+    dest = watch_env / "data" / "108S1" / target["file_name"]
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            state = WatchState(config.WATCH_STATE_PATH)
+            first = await watch_once(state, max_ahead=1)
+            assert not dest.exists()
+            assert target["df_name"] not in state.files
+
+            files[key] = real_csv
+            second = await watch_once(state, max_ahead=1)
+            return first, second, state
+        finally:
+            await server.cleanup()
+
+    first, second, state = asyncio.run(scenario())
+
+    assert target["df_name"] not in first
+    assert second == [target["df_name"]]
+    assert state.files[target["df_name"]]["status"] == "ok"
+    assert state.count == 10
+
+def test_download_tasks_replaces_saved_html_page(watch_env, monkeypatch):
+    tmp_path = watch_env / "data"
+    files, hits = {}, []
+    _publish(files, "108S1")
+    task = generate_tasks(seasons=["108S1"])[0]
+    stale = tmp_path / "108S1" / task["file_name"]
+    stale.parent.mkdir(parents=True)
+    stale.write_bytes(b"<html>not published</html>")
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            return await fetcher.download_tasks([task], base_dir=str(tmp_path))
+        finally:
+            await server.cleanup()
+
+    assert asyncio.run(scenario()) == [str(stale)]
+    assert stale.read_bytes() == files[("108S1", task["file_name"])]
+
+def _drift(files, key):
+    """把檔案改成缺少「總價元」欄位的格式"""
+    drop = MOI_ZH.index("總價元")
+    rows = [",".join(c for i, c in enumerate(l.split(",")) if i != drop)
+            for l in files[key].decode("utf-8").splitlines()[2:]]
+    files[key] = moi_csv(rows, MOI_ZH[:drop] + MOI_ZH[drop + 1:], MOI_EN[:drop] + MOI_EN[drop + 1:]).encode("utf-8")
+
+def test_watch_retries_drifted_file_after_layout_is_fixed(watch_env, monkeypatch):
+    files, hits = {}, []
+    _publish(files, "108S1")
+    target = generate_tasks(seasons=["108S1"])[-1]
+    key = ("108S1", target["file_name"])
+    good = files[key]
+    _drift(files, key)
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            state = WatchState(config.WATCH_STATE_PATH)
+            await watch_once(state, max_ahead=1)
+            assert state.files[target["df_name"]]["status"] == "failed"
+            assert state.files[target["df_name"]]["attempts"] == 1
+
+            # 來源更正後重新下載並解析
+            files[key] = good
+            hits.clear()
+            retried = await watch_once(state, max_ahead=1)
+            return retried, list(hits), state
+        finally:
+            await server.cleanup()
+
+    retried, retry_hits, state = asyncio.run(scenario())
+
+    assert retried == [target["df_name"]]
+    assert key in retry_hits
+    assert state.files[target["df_name"]]["status"] == "ok"
+    assert state.count == 10
+    assert len(pd.read_csv(watch_env / "output" / "filter.csv", encoding="utf-8-sig")) == 10
+
+def test_watch_stops_retrying_until_required_fields_change(watch_env, monkeypatch):
+    from rec import parser_cleaner, watch as watch_mod
+
+    files, hits = {}, []
+    _publish(files, "108S1")
+    target = generate_tasks(seasons=["108S1"])[-1]
+    key = ("108S1", target["file_name"])
+    _drift(files, key)
+    monkeypatch.setattr(watch_mod, "MAX_PARSE_ATTEMPTS", 2)
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            state = WatchState(config.WATCH_STATE_PATH)
+            downloads = []
+            for _ in range(3):
+                hits.clear()
+                await watch_once(state, max_ahead=1)
+                downloads.append(hits.count(key))
+            # 必要欄位改變後重新排入
+            monkeypatch.setattr(parser_cleaner, "REQUIRED_FIELDS", dict(parser_cleaner.REQUIRED_FIELDS, 鄉鎮市區="str"))
+            hits.clear()
+            await watch_once(state, max_ahead=1)
+            downloads.append(hits.count(key))
+            return downloads, state
+        finally:
+            await server.cleanup()
+
+    downloads, state = asyncio.run(scenario())
+
+    assert downloads == [1, 1, 0, 1]
+    assert state.files[target["df_name"]]["attempts"] == 1
+
+def test_interrupted_download_leaves_no_partial_file(watch_env, monkeypatch):
+    """寫檔中途中斷時目標檔不存在，下一輪會重新下載而不是解析半個檔案"""
+    files, hits = {}, []
+    _publish(files, "108S1")
+    task = generate_tasks(seasons=["108S1"])[0]
+    dest = watch_env / "data" / "108S1" / task["file_name"]
+    real_write = fetcher.atomic_write
+
+    @contextmanager
+    def interrupted_write(path, mode="w", encoding="utf-8"):
+        # 寫了一半就被中斷
+        with real_write(path, mode, encoding) as f:
+            f.write(b"truncated")
+            raise KeyboardInterrupt
+        yield f
+
+    async def scenario():
+        server, url = await _start_server(files, hits)
+        monkeypatch.setattr(fetcher, "BASE_URL", url)
+        try:
+            async with fetcher.aiohttp.ClientSession() as session:
+                monkeypatch.setattr(fetcher, "atomic_write", interrupted_write)
+                with pytest.raises(KeyboardInterrupt):
+                    await fetcher.download_file(session, fetcher.build_download_url("108S1", task["file_name"]),
+                                                str(dest), max_retries=1)
+            monkeypatch.setattr(fetcher, "atomic_write", real_write)
+            return await fetcher.download_tasks([task], base_dir=config.DATA_DIR)
+        finally:
+            await server.cleanup()
+
+    assert asyncio.run(scenario()) == [str(dest)]
+    assert dest.read_bytes() == files[("108S1", task["file_name"])]
+    assert [p.name for p in dest.parent.iterdir()] == [task["file_name"]]